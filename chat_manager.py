@@ -1,127 +1,609 @@
 # professorsulphite/sulphite_v1/sulphite_v1-e0f21b0d541b71aa42e22e2435a9b0b9f2caa2e4/chat_manager.py
+import json
+import math
 import os
-from typing import Dict, List
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from database import Database
 from classification import Classifier
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from logging_config import get_logger
 import config
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 from state_manager import StateManager
 from response_handler import ResponseHandler
+from embeddings import get_batcher, get_embedder
 
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+_json_decoder = json.JSONDecoder()
+
+# Cheap language heuristics tried before asking the model.
+_URDU_SCRIPT_RE = re.compile(r'[\u0600-\u06FF]')
+_WORD_RE = re.compile(r"[a-z]+")
+_ROMAN_URDU_STOPWORDS = frozenset({
+    "hai", "hain", "nahi", "kya", "mein", "aur", "par", "ke", "ka", "ki", "ko", "se",
+    "ho", "tum", "aap", "mujhe", "kaise", "kyun", "yeh", "woh", "bhi", "batao", "samjhao",
+    "karo", "karke", "dikhao", "ye", "kro", "hy", "nhi",
+})
+# English function words that don't double as Roman Urdu ("to", "is", "me", "do" do, so they're
+# left out), and no math verbs like "solve" or "explain" that students mix into Roman Urdu.
+_ENGLISH_STOPWORDS = frozenset({
+    "the", "what", "how", "why", "when", "which", "are", "does", "can", "could", "would",
+    "should", "of", "and", "you", "your", "my", "this", "that", "with", "for", "about", "please",
+    "an", "it", "was", "were", "will", "there", "from",
+})
+# A guess needs at least this many stopword hits for one language and none for the other.
+_LANGUAGE_GUESS_MIN_HITS = 2
+
+# Classification category -> system prompt.
+_PROMPT_MAPPING = {
+    config.CATEGORY_PRACTICAL: config.PRACTICAL_LEARNING_PROMPT,
+    config.CATEGORY_THEORETICAL: config.THEORETICAL_LEARNING_PROMPT,
+    config.CATEGORY_GENERAL: config.GENERAL_CHITCHAT_PROMPT,
+    config.CATEGORY_IRRELEVANT: config.IRRELEVANT_RESPONSE_PROMPT
+}
+
+# A streamed unified turn whose JSON header hasn't parsed after this many characters
+# is treated as malformed and handed to the sequential pipeline.
+UNIFIED_HEADER_MAX_CHARS = 2000
+
+# HNSW graph parameters for the per-session semantic memory index.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 64
+# The memory index switches to int8 scalar-quantized storage once it has this
+# many vectors to train the quantizer on; smaller sessions stay on FP32.
+SQ_MIN_TRAINING_SAMPLES = 64
+
+# Upper bound on the retrieved history and the AI's last message in each turn's prompt
+# (roughly 1.5k tokens each); the best-scoring snippets are kept first.
+CONTEXT_MAX_CHARS = 6000
+
+# Cross-session memory: an IVF index with an HNSW coarse quantizer over every
+# stored exchange, built offline by build_global_memory_index().
+GLOBAL_MEMORY_INDEX_PATH = "global_memory.faiss"
+GLOBAL_MEMORY_MAX_NLIST = 1024
+GLOBAL_MEMORY_NPROBE = 10
+# Extra candidates fetched per requested hit, since hits from other sessions are filtered out.
+GLOBAL_MEMORY_OVERSAMPLE = 4
+
+# Per-session memory indexes are persisted here so returning sessions skip re-embedding.
+SESSION_INDEX_DIR = "idx"
+# Write the session index after this many new exchanges (and on session switch / shutdown).
+SESSION_INDEX_SAVE_EVERY = 10
+
+# Semantic response cache: a new question whose embedding is this close to a
+# previously answered one (under the same language mode) reuses that answer.
+# Entries persist across restarts, so the bar is high.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# Questions with numbers or math operators never take part in semantic matching: the embedder
+# scores "12 times 7" and "12 times 8" as near-duplicates. Verbatim repeats still hit the exact cache.
+_MATH_RE = re.compile(r"[\d=+*/^<>%]")
+SEMANTIC_CACHE_MAX_ENTRIES = 512
+SEMANTIC_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+# Verbatim repeats of a cached question (ignoring case and whitespace) are answered from
+# an in-memory LRU before the question is even embedded.
+EXACT_CACHE_MAX_ENTRIES = 512
+# Only these categories are cached; practical answers walk a student through their own problem.
+SEMANTIC_CACHE_CATEGORIES = frozenset({config.CATEGORY_THEORETICAL, config.CATEGORY_GENERAL})
+
+def build_global_memory_index(db: Database, index_path: str = GLOBAL_MEMORY_INDEX_PATH, batch_size: int = 256) -> int:
+    """Embeds every stored exchange into an IVF-HNSW index and writes it, plus its id map, to disk.
+
+    Returns the number of vectors indexed.
+    """
+    id_map: List[Tuple[int, int, str]] = []
+    for message_id, session_id, user_input, model_response in db.get_all_messages():
+        id_map.append((session_id, message_id, f"User asked: {user_input}"))
+        id_map.append((session_id, message_id, f"AI answered: {model_response}"))
+    if not id_map:
+        return 0
+
+    texts = [text for _, _, text in id_map]
+    embeddings = np.vstack([
+        np.ascontiguousarray(get_embedder().encode(
+            texts[i:i + batch_size], batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        ), dtype=np.float32)
+        for i in range(0, len(texts), batch_size)
+    ])
+
+    # IVF needs roughly 40 training points per list, so small corpora get fewer lists.
+    nlist = max(1, min(GLOBAL_MEMORY_MAX_NLIST, int(4 * math.sqrt(len(embeddings))), len(embeddings) // 40))
+    index = faiss.index_factory(embeddings.shape[1], f"IVF{nlist}_HNSW{HNSW_M},Flat", faiss.METRIC_INNER_PRODUCT)
+    sample_size = min(len(embeddings), nlist * 256)
+    sample = embeddings[np.random.default_rng(0).choice(len(embeddings), sample_size, replace=False)]
+    index.train(sample)
+    index.add(embeddings)
+
+    faiss.write_index(index, index_path)
+    with open(f"{index_path}.json", "w", encoding="utf-8") as f:
+        json.dump(id_map, f)
+    return index.ntotal
+
+def _guess_language(query: str) -> Optional[str]:
+    """Returns "urdu" or "english" when script and stopwords make it obvious, otherwise None.
+
+    Short replies, bare math like "2x + 3 = 7" and words in neither stopword list give no
+    evidence either way, so they return None and the model's own language detection decides.
+    """
+    if _URDU_SCRIPT_RE.search(query):
+        return "urdu"
+    if not query.isascii():
+        return None
+    words = _WORD_RE.findall(query.lower())
+    urdu_hits = sum(1 for word in words if word in _ROMAN_URDU_STOPWORDS)
+    english_hits = sum(1 for word in words if word in _ENGLISH_STOPWORDS)
+    if urdu_hits >= _LANGUAGE_GUESS_MIN_HITS and english_hits == 0:
+        return "urdu"
+    if english_hits >= _LANGUAGE_GUESS_MIN_HITS and urdu_hits == 0:
+        return "english"
+    return None
 
 class ChatManager:
     def __init__(self, db: Database, state: StateManager):
         self.logger = get_logger("chat_manager")
+        faiss.omp_set_num_threads(os.cpu_count() or 1)
         self.db = db
         self.state = state
-        self.classifier = Classifier()
         
         gemini_api_key = os.getenv("GEMINI_API_KEY")
         if not gemini_api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set.")
         
         self.model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=gemini_api_key)
+        self.classifier = Classifier(self.model)
         self.response_handler = ResponseHandler(self.model)
+        # Runs the sequential pipeline's independent model calls side by side.
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sequential-turn")
+        self._format_language_detection_prompt = config.LANGUAGE_DETECTION_PROMPT.format
+        self._format_query_type_prompt = config.QUERY_TYPE_PROMPT.format
+        self.unified_system_prompt = config.UNIFIED_TURN_PROMPT.format(
+            topics_hierarchy=config.TOPICS_HIERARCHY_JSON,
+            general_chitchat_prompt=config.GENERAL_CHITCHAT_PROMPT,
+            practical_learning_prompt=config.PRACTICAL_LEARNING_PROMPT,
+            theoretical_learning_prompt=config.THEORETICAL_LEARNING_PROMPT,
+            irrelevant_response_prompt=config.IRRELEVANT_RESPONSE_PROMPT,
+        )
         
+        self.global_memory_index: faiss.Index | None = None
+        # (session id, message id, text) per global index entry.
+        self.global_memory_map: List[Tuple[int, int, str]] = []
+        # Oldest message id still stored for the current session. Global index entries older than
+        # this were removed by /clear after the index was built, and are not used.
+        self._global_memory_min_id: Optional[int] = None
+        self._load_global_memory_index()
+
         self.session_memory_texts: List[str] = []
         self.memory_index: faiss.Index | None = None
+        # Last AI response in the current session, kept in sync with the DB to avoid re-reading it every turn.
+        self._last_ai_message: str | None = None
+        self._memory_session_id: int | None = None
+        self._unsaved_memory_adds = 0
         self.initialize_session_memory()
 
+        # (prompt, response, system_prompt_key, timestamp) keyed by cache-index id, in LRU order.
+        self.response_cache: "OrderedDict[int, Tuple[str, str, str, float]]" = OrderedDict()
+        self.response_cache_index = faiss.IndexIDMap(faiss.IndexFlatIP(get_embedder().get_sentence_embedding_dimension()))
+        self._next_cache_id = 0
+        # (language mode, normalized prompt) -> response, in LRU order.
+        self.exact_response_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._load_response_cache()
+
+    def _load_global_memory_index(self, index_path: str = GLOBAL_MEMORY_INDEX_PATH):
+        if not os.path.exists(index_path) or not os.path.exists(f"{index_path}.json"):
+            return
+        try:
+            index = faiss.read_index(index_path)
+            with open(f"{index_path}.json", encoding="utf-8") as f:
+                id_map = [(session_id, message_id, text) for session_id, message_id, text in json.load(f)]
+        except (OSError, RuntimeError, ValueError) as e:
+            self.logger.error("Failed to load global memory index '%s' (rebuild it with --build-memory-index): %s", index_path, e)
+            return
+        faiss.extract_index_ivf(index).nprobe = GLOBAL_MEMORY_NPROBE
+        self.global_memory_index = index
+        self.global_memory_map = id_map
+        self.logger.info("Loaded global memory index with %d entries.", index.ntotal)
+
     def initialize_session_memory(self):
+        if self._unsaved_memory_adds:
+            self.save_session_memory()
+        session_id = self.state.get_session_id()
+        self._memory_session_id = session_id
         self.session_memory_texts = []
-        embedding_dim = embedding_model.get_sentence_embedding_dimension()
-        self.memory_index = faiss.IndexFlatL2(embedding_dim)
-        
-        past_messages = self.db.get_memory(self.state.get_session_id(), limit=100)
+        if self.global_memory_index is not None:
+            self._global_memory_min_id = self.db.get_first_message_id(session_id)
+        past_messages = self.db.get_memory(session_id, limit=100)
+        self._last_ai_message = past_messages[-1][1] if past_messages else None
         for user_input, model_response in past_messages:
             self.session_memory_texts.append(f"User asked: {user_input}")
             self.session_memory_texts.append(f"AI answered: {model_response}")
 
+        if self._load_session_memory(session_id):
+            self.logger.info("Loaded semantic memory for session %s from disk with %d entries.", session_id, len(self.session_memory_texts))
+            return
+
+        embeddings = None
         if self.session_memory_texts:
-            embeddings = embedding_model.encode(self.session_memory_texts)
-            self.memory_index.add(np.array(embeddings, dtype=np.float32))
-        self.logger.info(f"Initialized semantic memory for session {self.state.get_session_id()} with {len(self.session_memory_texts)} entries.")
+            embeddings = np.ascontiguousarray(get_embedder().encode(
+                self.session_memory_texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+            ), dtype=np.float32)
+        self.memory_index = self._build_memory_index(embeddings)
+        if embeddings is not None:
+            self.memory_index.add(embeddings)
+            self.save_session_memory()
+        self.logger.info("Initialized semantic memory for session %s with %d entries.", session_id, len(self.session_memory_texts))
+
+    @staticmethod
+    def _session_memory_paths(session_id: int) -> Tuple[str, str]:
+        base_path = os.path.join(SESSION_INDEX_DIR, str(session_id))
+        return f"{base_path}.faiss", f"{base_path}.json"
+
+    def _load_session_memory(self, session_id: int) -> bool:
+        """Restores a persisted index whose texts still end with the session's stored history."""
+        index_path, texts_path = self._session_memory_paths(session_id)
+        if not os.path.exists(index_path) or not os.path.exists(texts_path):
+            return False
+        try:
+            with open(texts_path, encoding="utf-8") as f:
+                saved_texts = json.load(f)
+            # The saved index may hold older entries than the DB window, but must end with the same history.
+            if not saved_texts or saved_texts[-len(self.session_memory_texts):] != self.session_memory_texts:
+                return False
+            index = faiss.read_index(index_path)
+        except (OSError, RuntimeError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable semantic memory for session %s: %s", session_id, e)
+            return False
+        if index.ntotal != len(saved_texts):
+            return False
+        self.memory_index = index
+        self.session_memory_texts = saved_texts
+        return True
+
+    def save_session_memory(self):
+        """Writes the current session's memory index and texts to disk."""
+        if self._memory_session_id is None or self.memory_index is None:
+            return
+        index_path, texts_path = self._session_memory_paths(self._memory_session_id)
+        try:
+            os.makedirs(SESSION_INDEX_DIR, exist_ok=True)
+            faiss.write_index(self.memory_index, index_path)
+            with open(texts_path, "w", encoding="utf-8") as f:
+                json.dump(self.session_memory_texts, f)
+            self._unsaved_memory_adds = 0
+        except (OSError, RuntimeError) as e:
+            self.logger.error("Failed to save semantic memory for session %s: %s", self._memory_session_id, e)
+
+    def _build_memory_index(self, training_embeddings: Optional[np.ndarray]) -> faiss.Index:
+        """Creates an HNSW index, int8-quantized when there are enough embeddings to train on."""
+        embedding_dim = get_embedder().get_sentence_embedding_dimension()
+        # Embeddings are L2-normalized, so inner product == cosine similarity.
+        if training_embeddings is not None and len(training_embeddings) >= SQ_MIN_TRAINING_SAMPLES:
+            index = faiss.IndexHNSWSQ(embedding_dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.train(training_embeddings)
+        else:
+            index = faiss.IndexHNSWFlat(embedding_dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        return get_batcher().encode([text])
 
     def _add_to_semantic_memory(self, user_input: str, model_response: str):
         new_texts = [f"User asked: {user_input}", f"AI answered: {model_response}"]
         self.session_memory_texts.extend(new_texts)
-        new_embeddings = embedding_model.encode(new_texts)
+        # Embeds the stored texts themselves, as initialize_session_memory does when it rebuilds the
+        # index, so an exchange scores the same whether it was added live or rebuilt.
+        new_embeddings = get_batcher().encode(new_texts)
         if self.memory_index:
-            self.memory_index.add(np.array(new_embeddings, dtype=np.float32))
+            self.memory_index.add(new_embeddings)
+            if not isinstance(self.memory_index, faiss.IndexHNSWSQ) and self.memory_index.ntotal >= SQ_MIN_TRAINING_SAMPLES:
+                # Enough samples have accumulated: rebuild the FP32 index as a trained int8 one.
+                embeddings = self.memory_index.reconstruct_n(0, self.memory_index.ntotal)
+                self.memory_index = self._build_memory_index(embeddings)
+                self.memory_index.add(embeddings)
+            self._unsaved_memory_adds += 1
+            if self._unsaved_memory_adds >= SESSION_INDEX_SAVE_EVERY:
+                self.save_session_memory()
 
-    def _get_conversation_context(self, query: str, k: int = 3) -> str:
-        if not self.session_memory_texts or not self.memory_index or self.memory_index.ntotal == 0:
+    def _get_conversation_context(self, query: str, k: int = 3, query_embedding: Optional[np.ndarray] = None) -> str:
+        has_session_memory = bool(self.session_memory_texts) and self.memory_index is not None and self.memory_index.ntotal > 0
+        has_global_memory = self.global_memory_index is not None and self._global_memory_min_id is not None
+        if not has_session_memory and not has_global_memory:
             return "No conversation history yet."
-        query_embedding = embedding_model.encode([query])
-        _, I = self.memory_index.search(np.array(query_embedding, dtype=np.float32), k)
-        relevant_snippets = [self.session_memory_texts[i] for i in I[0]]
+        if query_embedding is None:
+            query_embedding = self._embed_query(query)
+
+        # Best score per snippet across the session index and this session's slice of the global index.
+        scored_snippets: Dict[str, float] = {}
+        if has_session_memory:
+            D, I = self.memory_index.search(query_embedding, k)
+            for score, i in zip(D[0], I[0]):
+                if i >= 0:
+                    text = self.session_memory_texts[i]
+                    scored_snippets[text] = max(float(score), scored_snippets.get(text, -math.inf))
+        if has_global_memory:
+            session_id = self.state.get_session_id()
+            D, I = self.global_memory_index.search(query_embedding, k * GLOBAL_MEMORY_OVERSAMPLE)
+            for score, i in zip(D[0], I[0]):
+                if i < 0:
+                    continue
+                hit_session_id, message_id, text = self.global_memory_map[i]
+                if hit_session_id == session_id and message_id >= self._global_memory_min_id:
+                    scored_snippets[text] = max(float(score), scored_snippets.get(text, -math.inf))
+
+        if not scored_snippets:
+            return "No conversation history yet."
+        relevant_snippets = []
+        budget = CONTEXT_MAX_CHARS
+        for text in sorted(scored_snippets, key=scored_snippets.get, reverse=True)[:k]:
+            if budget <= 0:
+                break
+            relevant_snippets.append(text[:budget])
+            budget -= len(text) + 1
         return "\n".join(reversed(relevant_snippets))
 
+    def _load_response_cache(self):
+        """Restores unexpired response cache entries persisted by earlier runs, dropping the rest."""
+        rows = self.db.load_cached_responses(time.time() - SEMANTIC_CACHE_TTL_SECONDS, SEMANTIC_CACHE_MAX_ENTRIES)
+        # Entries stored before math questions were excluded are not reused.
+        rows = [row for row in rows if _MATH_RE.search(row[1]) is None]
+        if not rows:
+            return
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        embeddings = np.vstack([np.frombuffer(row[4], dtype=np.float32) for row in rows])
+        self.response_cache_index.add_with_ids(embeddings, ids)
+        for cache_id, prompt, response, cache_key, _, cached_at in rows:
+            self.response_cache[cache_id] = (prompt, response, cache_key, cached_at)
+        self._next_cache_id = int(ids.max()) + 1
+        self.logger.info("Loaded %d cached responses.", len(rows))
+
+    def _lookup_cached_response(self, query_embedding: np.ndarray, system_prompt_key: str) -> Optional[str]:
+        if self.response_cache_index.ntotal == 0:
+            return None
+        scores, ids = self.response_cache_index.search(query_embedding, 1)
+        cache_id = int(ids[0][0])
+        if cache_id < 0 or scores[0][0] < SEMANTIC_CACHE_THRESHOLD:
+            return None
+        _, response, cached_key, cached_at = self.response_cache[cache_id]
+        if time.time() - cached_at > SEMANTIC_CACHE_TTL_SECONDS:
+            self._evict_cached_response(cache_id)
+            return None
+        if cached_key != system_prompt_key:
+            return None
+        self.response_cache.move_to_end(cache_id)
+        return response
+
+    def _store_cached_response(self, query_embedding: np.ndarray, prompt: str, response: str, system_prompt_key: str):
+        cache_id = self._next_cache_id
+        self._next_cache_id += 1
+        cached_at = time.time()
+        self.response_cache_index.add_with_ids(query_embedding, np.array([cache_id], dtype=np.int64))
+        self.response_cache[cache_id] = (prompt, response, system_prompt_key, cached_at)
+        evicted_ids = []
+        while len(self.response_cache) > SEMANTIC_CACHE_MAX_ENTRIES:
+            evicted_ids.append(next(iter(self.response_cache)))
+            self._evict_cached_response(evicted_ids[-1], persist=False)
+        self.db.add_cached_response(
+            cache_id, prompt, response, system_prompt_key,
+            np.ascontiguousarray(query_embedding, dtype=np.float32).tobytes(), cached_at, evicted_ids
+        )
+
+    def _evict_cached_response(self, cache_id: int, persist: bool = True):
+        self.response_cache.pop(cache_id, None)
+        self.response_cache_index.remove_ids(np.array([cache_id], dtype=np.int64))
+        if persist:
+            self.db.delete_cached_response(cache_id)
+
     def _detect_language(self, query: str) -> str:
+        guessed_lang = _guess_language(query)
+        if guessed_lang is not None:
+            return guessed_lang
         try:
-            prompt = config.get_prompt("language_detection_prompt").format(user_input=query)
+            prompt = self._format_language_detection_prompt(user_input=query)
             response = self.model.invoke([HumanMessage(content=prompt)])
             return response.content.strip().lower()
         except Exception:
             return "other"
 
     def _get_query_type(self, user_input: str) -> str:
-        last_exchange = self.db.get_memory(self.state.get_session_id(), limit=1)
-        if not last_exchange or "?" not in last_exchange[0][1]:
+        if not self._last_ai_message or "?" not in self._last_ai_message:
             return "new_question"
         
-        _, last_ai_message = last_exchange[0]
-        prompt = config.get_prompt("query_type_prompt").format(last_ai_message=last_ai_message, user_input=user_input)
+        prompt = self._format_query_type_prompt(last_ai_message=self._last_ai_message, user_input=user_input)
         response = self.model.invoke([HumanMessage(content=prompt)])
         return response.content.strip().lower()
 
-    def call_model(self) -> str:
-        prompt = self.state.get_current_prompt()
+    def call_model(self, prompt: str) -> str:
+        return "".join(self.call_model_stream(prompt))
+
+    def call_model_stream(self, prompt: str) -> Iterator[str]:
+        """Yields the reply to prompt as it is generated; the turn is saved once it completes."""
         language_mode = self.state.get_language_mode()
         
         if "who are you" in prompt.lower() or "what is your name" in prompt.lower():
-            return self.response_handler.answer_identity_question()
+            yield self.response_handler.answer_identity_question()
+            return
 
-        if language_mode != "auto":
-            detected_lang = self._detect_language(prompt)
-            if detected_lang != "other" and detected_lang != language_mode:
-                if language_mode == "english": return "Language mode is set to English. Please type in English."
-                if language_mode == "urdu": return "Language mode Urdu par set hai. Baraye meharbani Urdu mein likhein."
+        guessed_lang = _guess_language(prompt) if language_mode != "auto" else None
+        if guessed_lang is not None and guessed_lang != language_mode:
+            yield self._language_mismatch_message(language_mode)
+            return
 
-        query_type = self._get_query_type(prompt)
-        classification_result = self.classifier.classify(prompt) if query_type == "new_question" else {"classification": "practical"}
+        # Only fresh questions are cacheable; a reply to the AI's own question depends on that question.
+        last_ai_message = self._last_ai_message
+        cacheable = not last_ai_message or "?" not in last_ai_message
+        exact_key = (language_mode, " ".join(prompt.lower().split()))
+        if cacheable:
+            cached_response = self.exact_response_cache.get(exact_key)
+            if cached_response is not None:
+                self.exact_response_cache.move_to_end(exact_key)
+                self.logger.info("Exact cache hit; reusing previous response.")
+                self.db.add_message_async(self.state.get_session_id(), prompt, cached_response)
+                self._last_ai_message = cached_response
+                self._add_to_semantic_memory(prompt, cached_response)
+                yield cached_response
+                return
 
-        context = self._get_conversation_context(prompt)
-        permanent_memory = self.state.get_permanent_memory()
-        full_context = f"PERMANENT USER NOTES:\n{permanent_memory}\n\nCONVERSATION HISTORY:\n{context}"
+        # Embedded once and shared by the cache lookup and context retrieval.
+        query_embedding = self._embed_query(prompt)
+        semantic_cacheable = _MATH_RE.search(prompt) is None
+        if cacheable and semantic_cacheable:
+            cached_response = self._lookup_cached_response(query_embedding, language_mode)
+            if cached_response is not None:
+                self.logger.info("Semantic cache hit; reusing previous response.")
+                self.db.add_message_async(self.state.get_session_id(), prompt, cached_response)
+                self._last_ai_message = cached_response
+                self._add_to_semantic_memory(prompt, cached_response)
+                yield cached_response
+                return
 
-        system_prompt = self._select_system_prompt(classification_result)
-        if language_mode == "english": system_prompt += "\n\nIMPORTANT: You must respond in English."
-        elif language_mode == "urdu": system_prompt += "\n\nIMPORTANT: You must respond in Roman Urdu."
+        context = self._get_conversation_context(prompt, query_embedding=query_embedding)
+        full_context = (
+            f"CONVERSATION HISTORY:\n{context}\n\n"
+            f"AI'S LAST MESSAGE:\n{last_ai_message[-CONTEXT_MAX_CHARS:] if last_ai_message else 'None'}"
+        )
+        system_prompt = self._static_prompt_prefix(self.unified_system_prompt, language_mode)
 
-        response = self.response_handler.generate_response(system_prompt, full_context, prompt)
-        
-        self.db.add_message(self.state.get_session_id(), prompt, response)
+        # One round-trip returns language, query type, classification and the answer together.
+        # The JSON header is read off the front of the stream; the answer is passed through as it arrives.
+        chunks = iter(self.response_handler.stream_response(system_prompt, full_context, prompt))
+        header = self._read_unified_header(chunks)
+        response = None
+        if header is not None:
+            turn_info, answer_head = header
+            detected_lang = guessed_lang or str(turn_info.get("lang", "other")).strip().lower()
+            if language_mode != "auto" and detected_lang != "other" and detected_lang != language_mode:
+                yield self._language_mismatch_message(language_mode)
+                return
+            if turn_info.get("query_type") == "answer" or turn_info["classification"] not in SEMANTIC_CACHE_CATEGORIES:
+                cacheable = False
+            self.logger.info("Unified turn classification: %s", turn_info)
+
+            # Buffer enough of the answer to spot a stray code fence the model may open it with.
+            while len(answer_head.strip()) < 3:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                answer_head += chunk
+            answer_head = answer_head.lstrip()
+            if answer_head.startswith("```"):
+                answer_head = answer_head[3:].lstrip()
+            parts = []
+            if answer_head:
+                parts.append(answer_head)
+                yield answer_head
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            response = "".join(parts).strip() or None
+
+        if response is None:
+            self.logger.warning("Unified turn response could not be parsed; falling back to sequential calls.")
+            # The sequential pipeline doesn't report its classification, so its answers aren't cached.
+            cacheable = False
+            response = self._call_model_sequential(prompt, language_mode, context)
+            if response is None:
+                yield self._language_mismatch_message(language_mode)
+                return
+            yield response
+
+        self.db.add_message_async(self.state.get_session_id(), prompt, response)
+        self._last_ai_message = response
         self._add_to_semantic_memory(prompt, response)
-        
-        return response
+        if cacheable:
+            if semantic_cacheable:
+                self._store_cached_response(query_embedding, prompt, response, language_mode)
+            self.exact_response_cache[exact_key] = response
+            if len(self.exact_response_cache) > EXACT_CACHE_MAX_ENTRIES:
+                self.exact_response_cache.popitem(last=False)
+
+    def _call_model_sequential(self, prompt: str, language_mode: str, context: str) -> Optional[str]:
+        """Legacy per-stage pipeline; returns None when the prompt is in the wrong language."""
+        # Language detection doesn't depend on the query type, so the two run side by side.
+        # Classification waits for both, since its result is only used for a new question in the
+        # right language.
+        language_future = self._executor.submit(self._detect_language, prompt) if language_mode != "auto" else None
+        query_type = self._get_query_type(prompt)
+        if language_future is not None:
+            detected_lang = language_future.result()
+            if detected_lang != "other" and detected_lang != language_mode:
+                return None
+
+        classification_result = self.classifier.classify(prompt) if query_type == "new_question" else {"classification": config.CATEGORY_PRACTICAL}
+
+        full_context = f"CONVERSATION HISTORY:\n{context}"
+
+        system_prompt = self._static_prompt_prefix(self._select_system_prompt(classification_result), language_mode)
+        return self.response_handler.generate_response(system_prompt, full_context, prompt)
+
+    def _read_unified_header(self, chunks: Iterator[str]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Consumes chunks until the unified turn's JSON header is complete.
+
+        Returns the header and any answer text that arrived with it, leaving the
+        rest of the answer in chunks, or None if no valid header shows up.
+        """
+        buffer = ""
+        error = "reply does not start with a JSON object"
+        for chunk in chunks:
+            buffer += chunk
+            content = buffer.lstrip()
+            if content.startswith("```"):
+                if "\n" not in content:
+                    continue
+                content = content.split("\n", 1)[1]
+            content = content.lstrip()
+            if not content:
+                continue
+            if not content.startswith("{"):
+                break
+            try:
+                turn_info, header_end = _json_decoder.raw_decode(content)
+            except json.JSONDecodeError as e:
+                error = e
+                if len(buffer) > UNIFIED_HEADER_MAX_CHARS:
+                    break
+                continue
+            classification = config.canonical_category(turn_info.get("classification")) if isinstance(turn_info, dict) else None
+            if classification is None:
+                self.logger.warning("Unified turn header has no valid classification: %s", turn_info)
+                return None
+            turn_info["classification"] = classification
+            return turn_info, content[header_end:]
+        self.logger.warning("Unified turn header is not valid JSON: %s", error)
+        return None
+
+    def _static_prompt_prefix(self, system_prompt: str, language_mode: str) -> str:
+        """Builds the system message from the parts that rarely change between turns.
+
+        Keeping the permanent notes here rather than in the per-turn context makes the whole
+        system message an identical prefix from turn to turn, which Gemini's implicit context
+        caching can reuse instead of re-processing.
+        """
+        return (
+            f"{system_prompt}{self._language_instruction(language_mode)}\n\n"
+            f"PERMANENT USER NOTES:\n{self.state.get_permanent_memory()}"
+        )
+
+    @staticmethod
+    def _language_instruction(language_mode: str) -> str:
+        if language_mode == "english": return "\n\nIMPORTANT: You must respond in English."
+        if language_mode == "urdu": return "\n\nIMPORTANT: You must respond in Roman Urdu."
+        return ""
+
+    @staticmethod
+    def _language_mismatch_message(language_mode: str) -> str:
+        if language_mode == "english": return "Language mode is set to English. Please type in English."
+        return "Language mode Urdu par set hai. Baraye meharbani Urdu mein likhein."
     
     def _select_system_prompt(self, classification_result: Dict) -> str:
-        classification = classification_result.get('classification', 'general')
-        prompt_mapping = {
-            'practical': 'practical_learning_prompt',
-            'theoretical': 'theoretical_learning_prompt', 
-            'general': 'general_chitchat_prompt',
-            'irrelevant': 'irrelevant_response_prompt'
-        }
-        prompt_key = prompt_mapping.get(classification, 'default_system_prompt')
-        return config.get_prompt(prompt_key)
+        classification = classification_result.get('classification', config.CATEGORY_GENERAL)
+        return _PROMPT_MAPPING.get(classification, config.DEFAULT_SYSTEM_PROMPT)
 
     def summarize_and_save_note(self, note_text: str):
         summary = self.response_handler.summarize_note(note_text)
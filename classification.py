@@ -26,24 +26,24 @@ Version: 2.0
 """
 
 import json
-import os
+import logging
+import re
 from typing import Dict, Any, Optional
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
-from dotenv import load_dotenv
-from logging_config import get_logger, sulphite_logger
+from logging_config import get_logger, sulphite_logger, trace
 import config
 
-# Load environment variables
-load_dotenv()
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; its errors subclass json.JSONDecodeError
+    from json import loads as json_loads
 
-# Get Gemini API key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set.")
+# Extracts the payload of a ```json ... ``` markdown fence
+_JSON_RE = re.compile(r"```json\s*(.*?)\s*```", re.S)
 
-# Initialize Google AI model
-google_ai = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GEMINI_API_KEY)
+# Fields a parsed classification result is projected onto
+_CLASSIFICATION_KEYS = ("classification", "main_topic", "sub_topic")
 
 
 class Classifier:
@@ -61,7 +61,7 @@ class Classifier:
         logger (logging.Logger): Logger for classification operations
     
     Example:
-        >>> classifier = Classifier()
+        >>> classifier = Classifier(model)
         >>> result = classifier.classify("How do I solve 2x + 3 = 7?")
         >>> print(result)
         {
@@ -71,23 +71,24 @@ class Classifier:
         }
     """
     
-    def __init__(self):
+    @trace
+    def __init__(self, model: ChatGoogleGenerativeAI):
         """
         Initialize the classifier with AI model and logging.
         
-        Sets up the classification prompt from config and initializes
-        the Google AI model for processing queries.
+        Sets up the classification prompt from config and reuses the
+        caller's Google AI model so its connection pool is shared.
+        
+        Args:
+            model (ChatGoogleGenerativeAI): Shared Gemini chat model
         """
         self.logger = get_logger("classification")
         
-        sulphite_logger.log_function_entry(self.logger, "__init__")
-        
         try:
-            self.classifier_prompt = config.prompts["classification_prompt"]
-            self.classification_model = google_ai
+            self.classifier_prompt = config.CLASSIFICATION_PROMPT
+            self.classification_model = model
             
             self.logger.info("Classifier initialized successfully with Gemini 1.5 Flash model")
-            sulphite_logger.log_function_exit(self.logger, "__init__", "Classifier initialized")
             
         except Exception as e:
             self.logger.error(f"Failed to initialize classifier: {e}")
@@ -112,7 +113,7 @@ class Classifier:
                 Returns empty dict {} for advanced topics or parsing errors
                 
         Example:
-            >>> classifier = Classifier()
+            >>> classifier = Classifier(model)
             >>> result = classifier.classify("What are prime numbers?")
             >>> result
             {
@@ -121,21 +122,6 @@ class Classifier:
                 "sub_topic": "Prime Numbers and Composite Numbers"
             }
         """
-        sulphite_logger.log_function_entry(
-            self.logger, 
-            "classify", 
-            query_length=len(user_input),
-            query_preview=user_input[:100]
-        )
-        
-        # Log the start of query processing
-        sulphite_logger.log_query_processing(
-            self.logger,
-            user_input,
-            "CLASSIFICATION_START",
-            {"model": "gemini-1.5-flash"}
-        )
-        
         try:
             # Prepare messages for the AI model
             messages = [
@@ -143,25 +129,17 @@ class Classifier:
                 HumanMessage(content=user_input),
             ]
             
-            self.logger.debug(f"Sending classification request to AI model")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Sending classification request to AI model")
             
             # Get response from AI model
             response = self.classification_model.invoke(messages)
             
-            sulphite_logger.log_query_processing(
-                self.logger,
-                user_input,
-                "AI_RESPONSE_RECEIVED",
-                {"response_length": len(response.content)}
-            )
-            
             # Parse the AI response
             result = self._parse_ai_response(response.content, user_input)
             
             # Log the final classification result
             sulphite_logger.log_classification_result(self.logger, user_input, result)
-            
-            sulphite_logger.log_function_exit(self.logger, "classify", result)
             return result
             
         except Exception as e:
@@ -170,7 +148,6 @@ class Classifier:
             # Return empty dict on any error
             error_result = {}
             sulphite_logger.log_classification_result(self.logger, user_input, error_result)
-            sulphite_logger.log_function_exit(self.logger, "classify", error_result)
             return error_result
 
     def _parse_ai_response(self, response_content: str, original_query: str) -> Dict[str, Any]:
@@ -188,37 +165,19 @@ class Classifier:
         Returns:
             Dict[str, Any]: Parsed classification result or empty dict on error
         """
-        sulphite_logger.log_function_entry(
-            self.logger, 
-            "_parse_ai_response",
-            content_length=len(response_content),
-            query_preview=original_query[:50]
-        )
-        
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        content = response_content
         try:
             # Log the raw response for debugging
-            self.logger.debug(f"Raw AI response: {response_content[:200]}...")
-            
-            # Clean the response content
-            content = response_content.strip()
+            if debug_enabled:
+                self.logger.debug(f"Raw AI response: {response_content[:200]}...")
             
             # Handle markdown-wrapped JSON
-            if content.startswith("```json"):
-                self.logger.debug("Detected markdown-wrapped JSON response")
-                # Extract content between ```json and ```
-                start_marker = "```json"
-                end_marker = "```"
-                start_idx = content.find(start_marker) + len(start_marker)
-                end_idx = content.rfind(end_marker)
-                
-                if start_idx > len(start_marker) - 1 and end_idx > start_idx:
-                    content = content[start_idx:end_idx].strip()
-                    self.logger.debug("Successfully extracted JSON from markdown")
-                else:
-                    self.logger.warning("Malformed markdown JSON wrapper detected")
+            match = _JSON_RE.search(response_content)
+            content = match.group(1) if match else response_content.strip()
             
             # Parse JSON content
-            json_response = json.loads(content)
+            json_response = json_loads(content)
             
             # Validate the response structure
             if not isinstance(json_response, dict):
@@ -226,40 +185,27 @@ class Classifier:
                 return {}
             
             # Log successful parsing
-            self.logger.debug(f"Successfully parsed JSON response: {json_response}")
+            if debug_enabled:
+                self.logger.debug(f"Successfully parsed JSON response: {json_response}")
             
             # Validate required fields
-            classification = json_response.get('classification', '')
-            if classification not in ['general', 'practical', 'theoretical', 'irrelevant']:
-                self.logger.warning(f"Invalid classification category: {classification}")
+            classification = config.canonical_category(json_response.get('classification'))
+            if classification is None:
+                self.logger.warning(f"Invalid classification category: {json_response.get('classification')}")
                 return {}
             
-            sulphite_logger.log_query_processing(
-                self.logger,
-                original_query,
-                "JSON_PARSING_SUCCESS",
-                {"classification": classification}
-            )
-            
-            sulphite_logger.log_function_exit(self.logger, "_parse_ai_response", json_response)
-            return json_response
+            result = {key: json_response.get(key) for key in _CLASSIFICATION_KEYS}
+            result['classification'] = classification
+            return result
             
         except json.JSONDecodeError as e:
             self.logger.error(f"JSON parsing failed: {e}")
             self.logger.error(f"Problematic content: {content[:500]}...")
             
-            sulphite_logger.log_query_processing(
-                self.logger,
-                original_query,
-                "JSON_PARSING_FAILED",
-                {"error": str(e)}
-            )
-            
         except Exception as e:
             self.logger.error(f"Unexpected error parsing AI response: {e}")
             
         # Return empty dict for any parsing error
-        sulphite_logger.log_function_exit(self.logger, "_parse_ai_response", {})
         return {}
 
     def validate_topic_hierarchy(self, main_topic: Optional[str], sub_topic: Optional[str]) -> bool:
@@ -273,29 +219,10 @@ class Classifier:
         Returns:
             bool: True if topics are valid according to hierarchy, False otherwise
         """
-        sulphite_logger.log_function_entry(
-            self.logger,
-            "validate_topic_hierarchy",
-            main_topic=main_topic,
-            sub_topic=sub_topic
+        is_valid = not main_topic or (
+            main_topic in config.VALID_MAIN_TOPICS
+            and (not sub_topic or (main_topic, sub_topic) in config.VALID_TOPIC_PAIRS)
         )
-        
-        if not main_topic:
-            sulphite_logger.log_function_exit(self.logger, "validate_topic_hierarchy", True)
-            return True
-        
-        # Check if main topic exists in hierarchy
-        if main_topic not in config.topics_hierarchy:
-            self.logger.warning(f"Main topic '{main_topic}' not found in hierarchy")
-            sulphite_logger.log_function_exit(self.logger, "validate_topic_hierarchy", False)
-            return False
-        
-        # Check if subtopic exists under the main topic
-        if sub_topic and sub_topic not in config.topics_hierarchy[main_topic]:
-            self.logger.warning(f"Sub topic '{sub_topic}' not found under '{main_topic}'")
-            sulphite_logger.log_function_exit(self.logger, "validate_topic_hierarchy", False)
-            return False
-        
-        self.logger.debug(f"Topic hierarchy validation passed: {main_topic} -> {sub_topic}")
-        sulphite_logger.log_function_exit(self.logger, "validate_topic_hierarchy", True)
-        return True
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Topic hierarchy validation {'passed' if is_valid else 'failed'}: {main_topic} -> {sub_topic}")
+        return is_valid
@@ -4,37 +4,49 @@ Sulphite Learning Assistant - Configuration Module
 This module contains all configuration settings for the Sulphite system including
 AI prompts for different learning styles, query classification instructions,
 and the educational topic hierarchy for middle school mathematics.
-"""
 
-from logging_config import get_logger
+v2.2: tone updated for a middle school audience; new prompts for query type,
+identity, and memory.
+"""
 
-config_logger = get_logger("config")
+import functools
+import json
+import logging
+import os
+import sys
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
+# Debug access logging is opt-in so that importing config never has to build the logging stack.
+_DEBUG_ENABLED = os.getenv("SULPHITE_DEBUG") == "1"
+_config_logger = None
+
+def _get_config_logger() -> logging.Logger:
+    """Imports logging_config and creates the config logger on first use."""
+    global _config_logger
+    if _config_logger is None:
+        from logging_config import get_logger
+        _config_logger = get_logger("config")
+    return _config_logger
+
+def __getattr__(name: str):
+    # PEP 562: keep `config.config_logger` working without creating it at import time.
+    if name == "config_logger":
+        return _get_config_logger()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def log_prompt_access(prompt_name: str) -> None:
-    config_logger.debug(f"Prompt accessed: {prompt_name}")
+    if not _DEBUG_ENABLED:
+        return
+    _get_config_logger().debug(f"Prompt accessed: {prompt_name}")
 
 def log_hierarchy_access(topic: str = None) -> None:
+    if not _DEBUG_ENABLED:
+        return
     if topic:
-        config_logger.debug(f"Topic hierarchy accessed for: {topic}")
+        _get_config_logger().debug(f"Topic hierarchy accessed for: {topic}")
     else:
-        config_logger.debug("Full topic hierarchy accessed")
-
-
-"""
-Sulphite Learning Assistant - Configuration Module (v2.2)
-- Tone updated for a middle school audience.
-- New prompts for query type, identity, and memory.
-"""
-
-from logging_config import get_logger
-
-config_logger = get_logger("config")
-
-def get_prompt(prompt_name: str) -> str:
-    """Safely retrieve a prompt from the configuration with logging."""
-    if prompt_name not in prompts:
-        raise KeyError(f"Prompt '{prompt_name}' not found in configuration")
-    return prompts[prompt_name]
+        _get_config_logger().debug("Full topic hierarchy accessed")
 
 prompts = {
     "language_detection_prompt": """Detect the language of the following user input. Respond with only "english", "urdu", or "other". Roman Urdu should be classified as "urdu".
@@ -55,11 +67,7 @@ Language:""",
     
     "classification_prompt": """You are an expert in both English and Roman Urdu. Classify the user's input into one of the following categories: 'general', 'practical', 'theoretical', or 'irrelevant'.
 If the query is 'practical' or 'theoretical', identify the main topic and sub-topic from the following hierarchy:
-{
-    "Numbers and Operations": ["Integers", "Fractions"],
-    "Arithmetic": ["Addition and Subtraction", "Multiplication and Division", "Order of Operations (PEMDAS)"],
-    "Basic Algebra": ["Variables and Expressions", "Simple Equations and Inequalities"]
-}
+{hierarchy_json}
 Respond with a JSON object: {"classification": "category", "main_topic": "topic", "sub_topic": "subtopic"}.
 For 'general' or 'irrelevant' classifications, topics should be null.
 
@@ -80,6 +88,27 @@ AI's Last Message: "{last_ai_message}"
 User's Input: "{user_input}"
 Type:""",
 
+    "unified_turn_prompt": """You are Sulphite, an Adaptive AI Tutor for Middle School Math. For the user's LATEST message, do all of the following in a single reply.
+
+1. Detect its language: "english", "urdu", or "other". Roman Urdu should be classified as "urdu".
+2. Decide its query type using the AI's last message: "answer" if it answers a question the AI asked, otherwise "new_question".
+3. Classify it into one of: 'general', 'practical', 'theoretical', or 'irrelevant'. An "answer" is always 'practical'.
+- 'general': Casual chat, greetings. (e.g., "How are you?")
+- 'practical': Asks for examples, real-world uses, or practice problems. (e.g., "Give me a question")
+- 'theoretical': Asks for definitions or explanations. (e.g., "What are integers?")
+- 'irrelevant': Off-topic.
+If the classification is 'practical' or 'theoretical', identify the main topic and sub-topic from the following hierarchy, otherwise topics should be null:
+{topics_hierarchy}
+4. Answer the user, following the guide for the classification you chose:
+- 'general': {general_chitchat_prompt}
+- 'practical': {practical_learning_prompt}
+- 'theoretical': {theoretical_learning_prompt}
+- 'irrelevant': {irrelevant_response_prompt}
+
+The FIRST line of your reply must be only this JSON object:
+{{"lang": "language", "query_type": "type", "classification": "category", "main_topic": "topic", "sub_topic": "subtopic"}}
+Write your answer to the user on the lines after it.""",
+
     "identity_prompt": """I'm Sulphite! Your friendly AI study buddy for middle school math. Think of me as a calculator that can also tell jokes (math jokes, of course!). My mission is to make learning math fun and help you understand even the trickiest topics. What should we explore today?""",
 
     "summarize_note_prompt": """Summarize the following text for a long-term user note. Focus on the user's learning style and difficulties. Max 300 words.
@@ -89,64 +118,107 @@ Summary:"""
 }
 
 # --- CURRICULUM & METADATA ---
-topics_hierarchy = {
-    "Numbers and Operations": [
+# Read-only; json.dumps needs dict(topics_hierarchy).
+topics_hierarchy = MappingProxyType({
+    "Numbers and Operations": (
         "Natural Numbers", "Whole Numbers", "Integers", "Rational Numbers and Irrational Numbers", "Real Numbers"
-    ],
-    "Arithmetic": [
+    ),
+    "Arithmetic": (
         "Addition and Subtraction", "Multiplication and Division", "Order of Operations (PEMDAS)", "Factors and Multiples", "Prime Numbers and Composite Numbers"
-    ],
-    "Basic Algebra": [
+    ),
+    "Basic Algebra": (
         "Variables and Expressions", "Simple Equations and Inequalities", "Patterns and Sequences", "Coordinate Plane and Graphing", "Linear Equations and Systems"
-    ]   
-}
-
+    )
+})
+
+# Kept for existing callers; topics_hierarchy itself is now read-only.
+TOPICS_HIERARCHY_FROZEN = topics_hierarchy
+
+# Precomputed for O(1) topic validation
+VALID_MAIN_TOPICS = frozenset(topics_hierarchy)
+VALID_TOPIC_PAIRS = frozenset((main, sub) for main, subs in topics_hierarchy.items() for sub in subs)
+
+# Serialized once and spliced into the classification prompt, so the prompt always lists the
+# real hierarchy. str.replace is used because the prompt contains literal JSON braces.
+TOPICS_HIERARCHY_JSON = json.dumps(dict(topics_hierarchy), indent=4)
+prompts["classification_prompt"] = prompts["classification_prompt"].replace("{hierarchy_json}", TOPICS_HIERARCHY_JSON)
+
+# Module-level bindings so per-turn callers read prompts directly, bypassing get_prompt().
+LANGUAGE_DETECTION_PROMPT = prompts["language_detection_prompt"]
+GENERAL_CHITCHAT_PROMPT = prompts["general_chitchat_prompt"]
+DEFAULT_SYSTEM_PROMPT = prompts["default_system_prompt"]
+PRACTICAL_LEARNING_PROMPT = prompts["practical_learning_prompt"]
+THEORETICAL_LEARNING_PROMPT = prompts["theoretical_learning_prompt"]
+IRRELEVANT_RESPONSE_PROMPT = prompts["irrelevant_response_prompt"]
+CLASSIFICATION_PROMPT = prompts["classification_prompt"]
+QUERY_TYPE_PROMPT = prompts["query_type_prompt"]
+UNIFIED_TURN_PROMPT = prompts["unified_turn_prompt"]
+IDENTITY_PROMPT = prompts["identity_prompt"]
+SUMMARIZE_NOTE_PROMPT = prompts["summarize_note_prompt"]
+
+# Prompts never change after import.
+prompts = MappingProxyType(prompts)
+
+# Prompts resolved once at import; get_prompt sits on the per-turn path, so it does no logging.
+# An alias of the read-only prompts mapping, not a writable copy.
+compiled_prompts = prompts
 
 def get_prompt(prompt_name: str) -> str:
+    try:
+        return compiled_prompts[prompt_name]
+    except KeyError:
+        raise KeyError(f"Prompt '{prompt_name}' not found in configuration") from None
+
+def get_prompt_logged(prompt_name: str) -> str:
     log_prompt_access(prompt_name)
-    if prompt_name not in prompts:
-        config_logger.error(f"Prompt not found: {prompt_name}")
+    if prompt_name not in compiled_prompts:
+        _get_config_logger().error(f"Prompt not found: {prompt_name}")
         raise KeyError(f"Prompt '{prompt_name}' not found in configuration")
-    return prompts[prompt_name]
+    return compiled_prompts[prompt_name]
 
-def get_topic_hierarchy() -> dict:
+def get_topic_hierarchy() -> Mapping[str, Tuple[str, ...]]:
     log_hierarchy_access()
     return topics_hierarchy
 
-def get_subtopics(main_topic: str) -> list:
-    log_hierarchy_access(main_topic)
+# The hierarchy is immutable, so both lookups are memoized; their bodies stay free of
+# logging because a cache hit would skip it anyway. Misses raise and are not cached.
+@functools.lru_cache(maxsize=64)
+def get_subtopics(main_topic: str) -> Tuple[str, ...]:
     if main_topic not in topics_hierarchy:
-        config_logger.error(f"Main topic not found: {main_topic}")
+        _get_config_logger().error(f"Main topic not found: {main_topic}")
         raise KeyError(f"Main topic '{main_topic}' not found in hierarchy")
-    subtopics = topics_hierarchy[main_topic]
-    config_logger.debug(f"Retrieved {len(subtopics)} subtopics for '{main_topic}'")
-    return subtopics
+    return topics_hierarchy[main_topic]
 
+@functools.lru_cache(maxsize=64)
 def validate_topic_combination(main_topic: str, sub_topic: str) -> bool:
-    log_hierarchy_access(f"{main_topic} -> {sub_topic}")
-    try:
-        subtopics = get_subtopics(main_topic)
-        is_valid = sub_topic in subtopics
-        if is_valid:
-            config_logger.debug(f"Valid topic combination: {main_topic} -> {sub_topic}")
-        else:
-            config_logger.warning(f"Invalid topic combination: {main_topic} -> {sub_topic}")
-        return is_valid
-    except KeyError:
-        config_logger.warning(f"Invalid main topic in validation: {main_topic}")
-        return False
+    return (main_topic, sub_topic) in VALID_TOPIC_PAIRS
 
 CONFIG_VERSION = "2.0"
-SUPPORTED_LEARNING_STYLES = ["practical", "theoretical", "general", "irrelevant"]
-SUPPORTED_MAIN_TOPICS = list(topics_hierarchy.keys())
+# Tuples, like the topic hierarchy, so get_config_info's shallow copies share nothing mutable.
+SUPPORTED_LEARNING_STYLES = ("practical", "theoretical", "general", "irrelevant")
+SUPPORTED_MAIN_TOPICS = tuple(topics_hierarchy.keys())
+
+# Interned category names. Parsers swap the model's strings for these so later comparisons and
+# dict lookups succeed on identity instead of comparing characters.
+CATEGORY_PRACTICAL, CATEGORY_THEORETICAL, CATEGORY_GENERAL, CATEGORY_IRRELEVANT = map(sys.intern, SUPPORTED_LEARNING_STYLES)
+CATEGORIES = frozenset((CATEGORY_PRACTICAL, CATEGORY_THEORETICAL, CATEGORY_GENERAL, CATEGORY_IRRELEVANT))
+_CANONICAL_CATEGORIES = {category: category for category in CATEGORIES}
+
+def canonical_category(name: Any) -> Optional[str]:
+    """Returns the interned category matching name, or None if it is not a known category."""
+    return _CANONICAL_CATEGORIES.get(name) if isinstance(name, str) else None
+
+# Everything here is fixed at import, so the totals are computed once.
+_CONFIG_INFO = {
+    "version": CONFIG_VERSION,
+    "supported_learning_styles": SUPPORTED_LEARNING_STYLES,
+    "supported_main_topics": SUPPORTED_MAIN_TOPICS,
+    "total_prompts": len(prompts),
+    "total_main_topics": len(topics_hierarchy),
+    "total_subtopics": sum(len(subtopics) for subtopics in topics_hierarchy.values())
+}
 
 def get_config_info() -> dict:
-    config_logger.debug("Configuration info requested")
-    return {
-        "version": CONFIG_VERSION,
-        "supported_learning_styles": SUPPORTED_LEARNING_STYLES,
-        "supported_main_topics": SUPPORTED_MAIN_TOPICS,
-        "total_prompts": len(prompts),
-        "total_main_topics": len(topics_hierarchy),
-        "total_subtopics": sum(len(subtopics) for subtopics in topics_hierarchy.values())
-    }
\ No newline at end of file
+    if _DEBUG_ENABLED:
+        _get_config_logger().debug("Configuration info requested")
+    return _CONFIG_INFO.copy()
\ No newline at end of file
@@ -1,24 +1,128 @@
 # professorsulphite/sulphite_v1/sulphite_v1-e0f21b0d541b71aa42e22e2435a9b0b9f2caa2e4/database.py
+import queue
 import sqlite3
-from typing import List, Tuple, Optional
-from logging_config import get_logger, sulphite_logger
+import threading
+import time
+from typing import Iterable, List, Tuple, Optional
+from logging_config import get_logger, trace
+
+_SENTINEL = object()
+# Database files whose schema has already been ensured by this process.
+_INITIALIZED = set()
+# Bump when create_tables gains a new table, index or migration.
+CURRENT_SCHEMA_VERSION = 4
 
 class Database:
+    # Hot-path statements are kept as class constants so every call hands sqlite3 the same
+    # string object and hits its compiled-statement cache.
+    _SQL_ADD_MESSAGE = "INSERT INTO memory (session_id, user_input, model_response) VALUES (?, ?, ?)"
+    _SQL_GET_MEMORY = """
+        SELECT user_input, model_response FROM (
+            SELECT id, user_input, model_response FROM memory
+            WHERE session_id = ? ORDER BY id DESC LIMIT ?
+        ) ORDER BY id ASC
+    """
+    _SQL_GET_SESSION = "SELECT id FROM sessions WHERE name = ?"
+    _SQL_CLEAR_MEMORY = "DELETE FROM memory WHERE session_id = ?"
+    _SQL_ADD_CACHED_RESPONSE = """
+        INSERT OR REPLACE INTO response_cache (id, prompt, response, cache_key, embedding, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    _SQL_DELETE_CACHED_RESPONSE = "DELETE FROM response_cache WHERE id = ?"
+    _MEMORY_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            user_input TEXT NOT NULL,
+            model_response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
+        )
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+    # The background writer commits queued messages in batches of up to this many rows,
+    # waiting at most this long for a batch to fill.
+    _WRITE_BATCH_MAX = 64
+    _WRITE_BATCH_WAIT = 0.05
+
+    @trace
     def __init__(self, db_name: str = "sulphite.db"):
         self.logger = get_logger("database")
-        sulphite_logger.log_function_entry(self.logger, "__init__", db_name=db_name)
         self.db_name = db_name
+        # permanent_memory is a single row that changes rarely; it is read once and then
+        # served from here until update_permanent_memory replaces it.
+        self._perm_cache = _SENTINEL
+        self._perm_lock = threading.RLock()
+        # The connection may be shared across threads, including the background writer, so every
+        # use of it goes through this lock. Reads don't open a transaction, only writes commit.
+        self._conn_lock = threading.Lock()
+        self._write_queue: "queue.SimpleQueue[Optional[Tuple[int, str, str]]]" = queue.SimpleQueue()
+        self._write_cond = threading.Condition()
+        self._queued_writes = 0
+        self._completed_writes = 0
+        # Messages the writer could not save, and the last error, until flush(raise_errors=True) reports them.
+        self._failed_writes = 0
+        self._last_write_error: Optional[sqlite3.Error] = None
+        self._writer: Optional[threading.Thread] = None
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = sqlite3.connect(self.db_name, cached_statements=256, check_same_thread=False)
+            # WAL + synchronous=NORMAL turns each commit into a WAL append instead of a full fsync,
+            # and lets readers proceed while a write is in progress.
+            self.conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+                PRAGMA cache_size=-20000;
+            """)
             self.logger.info(f"Database connection established: {db_name}")
-            self.create_tables()
+            # An in-memory database is new for every connection, so it always needs its tables.
+            if db_name == ":memory:" or db_name not in _INITIALIZED:
+                self.create_tables()
+                _INITIALIZED.add(db_name)
+            # Enabled after create_tables so a legacy memory table can be rebuilt first.
+            self.conn.execute("PRAGMA foreign_keys=ON")
         except sqlite3.Error as e:
             self.logger.error(f"Failed to initialize database: {e}")
             raise
 
+    @classmethod
+    def get_shared(cls, db_name: str = "sulphite.db") -> "Database":
+        """Returns the process-wide Database for db_name, opening it on first use."""
+        with cls._shared_lock:
+            db = cls._shared.get(db_name)
+            if db is None:
+                db = cls._shared[db_name] = cls(db_name)
+            return db
+
+    @trace
+    def close(self) -> None:
+        if self._writer is not None:
+            try:
+                self.flush(raise_errors=True)
+            finally:
+                self._write_queue.put(None)
+                self._writer.join()
+                self._writer = None
+        with Database._shared_lock:
+            if Database._shared.get(self.db_name) is self:
+                del Database._shared[self.db_name]
+        self.conn.close()
+        self.logger.info(f"Database connection closed: {self.db_name}")
+
+    def __enter__(self) -> "Database":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    @trace
     def create_tables(self) -> None:
-        sulphite_logger.log_function_entry(self.logger, "create_tables")
         try:
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] >= CURRENT_SCHEMA_VERSION:
+                return
             with self.conn:
                 self.conn.execute("""
                     CREATE TABLE IF NOT EXISTS sessions (
@@ -27,93 +131,355 @@ class Database:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                self.conn.execute("""
-                    CREATE TABLE IF NOT EXISTS memory (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        session_id INTEGER NOT NULL,
-                        user_input TEXT NOT NULL,
-                        model_response TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (session_id) REFERENCES sessions (id)
-                    )
-                """)
+                self.conn.execute(self._MEMORY_TABLE_SQL.format(table="memory"))
+                self._backfill_sessions()
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_memory_session_id ON memory (session_id, id DESC)"
+                )
                 self.conn.execute("""
                     CREATE TABLE IF NOT EXISTS permanent_memory (
                         id INTEGER PRIMARY KEY CHECK (id = 1),
                         notes TEXT NOT NULL
                     )
                 """)
+                self.conn.execute("""
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        id INTEGER PRIMARY KEY,
+                        prompt TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        cache_key TEXT NOT NULL,
+                        embedding BLOB NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                self.conn.execute("""
+                    CREATE TABLE IF NOT EXISTS pending_notes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        note TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            self._migrate_memory_cascade()
+            orphans = self.conn.execute(
+                "SELECT COUNT(*) FROM memory WHERE session_id NOT IN (SELECT id FROM sessions)"
+            ).fetchone()[0]
+            if orphans:
+                raise sqlite3.IntegrityError(f"{orphans} messages reference sessions that do not exist")
+            self.conn.execute(f"PRAGMA user_version = {CURRENT_SCHEMA_VERSION}")
         except sqlite3.Error as e:
             self.logger.error(f"Failed to create tables: {e}")
             raise
 
+    def _backfill_sessions(self) -> None:
+        """Creates the sessions row for session 1 and for every session id memory refers to.
+
+        StateManager starts on session 1, and with foreign keys on, messages for a session
+        without a row can't be saved. Rows are inserted by id; if the usual name is already
+        taken by another session, a numeric suffix is added.
+        """
+        missing = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT session_id FROM memory WHERE session_id NOT IN (SELECT id FROM sessions)"
+        )]
+        if 1 not in missing and self.conn.execute("SELECT 1 FROM sessions WHERE id = 1").fetchone() is None:
+            missing.insert(0, 1)
+        for session_id in missing:
+            base_name = "default" if session_id == 1 else f"session_{session_id}"
+            name, suffix = base_name, 1
+            while self.conn.execute(self._SQL_GET_SESSION, (name,)).fetchone() is not None:
+                suffix += 1
+                name = f"{base_name}_{suffix}"
+            self.conn.execute("INSERT INTO sessions (id, name) VALUES (?, ?)", (session_id, name))
+
+    def _migrate_memory_cascade(self) -> None:
+        """Rebuilds a memory table created before its foreign key gained ON DELETE CASCADE."""
+        foreign_keys = self.conn.execute("PRAGMA foreign_key_list(memory)").fetchall()
+        if all(fk[6].upper() == "CASCADE" for fk in foreign_keys):
+            return
+        self.logger.info("Migrating memory table to ON DELETE CASCADE")
+        try:
+            self.conn.executescript(f"""
+                BEGIN;
+                {self._MEMORY_TABLE_SQL.format(table="memory_new")};
+                INSERT INTO memory_new (id, session_id, user_input, model_response)
+                    SELECT id, session_id, user_input, model_response FROM memory;
+                DROP TABLE memory;
+                ALTER TABLE memory_new RENAME TO memory;
+                CREATE INDEX IF NOT EXISTS idx_memory_session_id ON memory (session_id, id DESC);
+                COMMIT;
+            """)
+        except sqlite3.Error:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            raise
+
+    @trace
     def create_session(self, name: str) -> int:
         try:
-            with self.conn:
+            with self._conn_lock, self.conn:
                 cursor = self.conn.execute("INSERT INTO sessions (name) VALUES (?)", (name,))
                 return cursor.lastrowid
         except sqlite3.Error as e:
             self.logger.error(f"Failed to create session '{name}': {e}")
             raise
 
+    @trace
     def get_session(self, name: str) -> Optional[int]:
         try:
-            with self.conn:
-                cursor = self.conn.execute("SELECT id FROM sessions WHERE name = ?", (name,))
+            with self._conn_lock:
+                cursor = self.conn.execute(self._SQL_GET_SESSION, (name,))
                 row = cursor.fetchone()
                 return row[0] if row else None
         except sqlite3.Error as e:
             self.logger.error(f"Failed to get session '{name}': {e}")
             raise
 
+    @trace
     def add_message(self, session_id: int, user_input: str, model_response: str) -> None:
         try:
-            with self.conn:
-                self.conn.execute(
-                    "INSERT INTO memory (session_id, user_input, model_response) VALUES (?, ?, ?)",
-                    (session_id, user_input, model_response)
-                )
+            with self._conn_lock, self.conn:
+                self.conn.execute(self._SQL_ADD_MESSAGE, (session_id, user_input, model_response))
         except sqlite3.Error as e:
             self.logger.error(f"Failed to add message to session {session_id}: {e}")
             raise
 
-    def get_memory(self, session_id: int, limit: int = 5) -> List[Tuple[str, str]]:
+    @trace
+    def add_messages(self, session_id: int, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Inserts many (user_input, model_response) pairs in a single transaction."""
         try:
-            with self.conn:
-                cursor = self.conn.execute(
-                    "SELECT user_input, model_response FROM memory WHERE session_id = ? ORDER BY id DESC LIMIT ?",
-                    (session_id, limit)
+            with self._conn_lock, self.conn:
+                self.conn.executemany(
+                    self._SQL_ADD_MESSAGE, ((session_id, user_input, model_response) for user_input, model_response in pairs)
                 )
-                return cursor.fetchall()[::-1]
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to add messages to session {session_id}: {e}")
+            raise
+
+    @trace
+    def add_message_async(self, session_id: int, user_input: str, model_response: str) -> None:
+        """Queues a message for the background writer and returns without waiting for the commit."""
+        with self._write_cond:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="db-writer", daemon=True)
+                self._writer.start()
+            self._queued_writes += 1
+        self._write_queue.put((session_id, user_input, model_response))
+
+    @trace
+    def flush(self, raise_errors: bool = False) -> None:
+        """Blocks until every message queued so far by add_message_async is handled.
+
+        Reads flush only to see earlier writes and never raise for them. A caller waiting for
+        durability passes raise_errors=True to get sqlite3.Error if any queued message could
+        not be saved since the last such call.
+        """
+        with self._write_cond:
+            target = self._queued_writes
+            self._write_cond.wait_for(lambda: self._completed_writes >= target)
+            if not raise_errors or not self._failed_writes:
+                return
+            failed, error = self._failed_writes, self._last_write_error
+            self._failed_writes, self._last_write_error = 0, None
+        raise sqlite3.Error(f"Background writer failed to save {failed} messages: {error}") from error
+
+    def _run_writer(self) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._WRITE_BATCH_WAIT
+            while len(batch) < self._WRITE_BATCH_MAX:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._write_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write_queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            finally:
+                with self._write_cond:
+                    self._completed_writes += len(batch)
+                    self._write_cond.notify_all()
+
+    def _write_batch(self, batch: List[Tuple[int, str, str]]) -> None:
+        """Commits a batch in one transaction, or row by row if that fails, dropping only bad rows."""
+        try:
+            with self._conn_lock, self.conn:
+                self.conn.executemany(self._SQL_ADD_MESSAGE, batch)
+            return
+        except sqlite3.Error as e:
+            if len(batch) == 1:
+                self._record_write_error(batch[0], e)
+                return
+        for row in batch:
+            try:
+                with self._conn_lock, self.conn:
+                    self.conn.execute(self._SQL_ADD_MESSAGE, row)
+            except sqlite3.Error as e:
+                self._record_write_error(row, e)
+
+    def _record_write_error(self, row: Tuple[int, str, str], error: sqlite3.Error) -> None:
+        self.logger.error(f"Background writer failed to add message to session {row[0]}: {error}")
+        with self._write_cond:
+            self._failed_writes += 1
+            self._last_write_error = error
+
+    @trace
+    def get_memory(self, session_id: int, limit: int = 5) -> List[Tuple[str, str]]:
+        self.flush()
+        try:
+            with self._conn_lock:
+                cursor = self.conn.execute(self._SQL_GET_MEMORY, (session_id, limit))
+                return cursor.fetchall()
         except sqlite3.Error as e:
             self.logger.error(f"Failed to get memory for session {session_id}: {e}")
             raise
 
+    @trace
+    def get_all_messages(self) -> List[Tuple[int, int, str, str]]:
+        """Returns every stored (id, session_id, user_input, model_response) row, oldest first."""
+        self.flush()
+        try:
+            with self._conn_lock:
+                cursor = self.conn.execute("SELECT id, session_id, user_input, model_response FROM memory ORDER BY id")
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to get all messages: {e}")
+            raise
+
+    @trace
+    def get_first_message_id(self, session_id: int) -> Optional[int]:
+        """Returns the id of the oldest message still stored for the session, or None if it has none."""
+        self.flush()
+        try:
+            with self._conn_lock:
+                return self.conn.execute("SELECT MIN(id) FROM memory WHERE session_id = ?", (session_id,)).fetchone()[0]
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to get first message id for session {session_id}: {e}")
+            raise
+
+    @trace
     def clear_memory(self, session_id: int) -> None:
+        self.flush()
         try:
-            with self.conn:
-                self.conn.execute("DELETE FROM memory WHERE session_id = ?", (session_id,))
+            with self._conn_lock, self.conn:
+                self.conn.execute(self._SQL_CLEAR_MEMORY, (session_id,))
         except sqlite3.Error as e:
             self.logger.error(f"Failed to clear memory for session {session_id}: {e}")
             raise
     
-    def get_permanent_memory(self) -> Optional[str]:
+    @trace
+    def delete_session(self, session_id: int) -> int:
+        """Deletes a session; its messages go with it via ON DELETE CASCADE. Returns sessions removed."""
+        self.flush()
         try:
-            with self.conn:
-                cursor = self.conn.execute("SELECT notes FROM permanent_memory WHERE id = 1")
-                row = cursor.fetchone()
-                return row[0] if row else None
+            with self._conn_lock, self.conn:
+                return self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
         except sqlite3.Error as e:
-            self.logger.error(f"Failed to get permanent memory: {e}")
-            return None
+            self.logger.error(f"Failed to delete session {session_id}: {e}")
+            raise
 
+    @trace
+    def get_permanent_memory(self) -> Optional[str]:
+        with self._perm_lock:
+            if self._perm_cache is not _SENTINEL:
+                return self._perm_cache
+            try:
+                with self._conn_lock:
+                    cursor = self.conn.execute("SELECT notes FROM permanent_memory WHERE id = 1")
+                    row = cursor.fetchone()
+            except sqlite3.Error as e:
+                self.logger.error(f"Failed to get permanent memory: {e}")
+                return None
+            self._perm_cache = row[0] if row else None
+            return self._perm_cache
+
+    @trace
     def update_permanent_memory(self, notes: str) -> None:
+        with self._perm_lock:
+            try:
+                with self._conn_lock, self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO permanent_memory (id, notes) VALUES (1, ?)", (notes,)
+                    )
+                self._perm_cache = notes
+                self.logger.info("Permanent memory updated.")
+            except sqlite3.Error as e:
+                self.logger.error(f"Failed to update permanent memory: {e}")
+                raise
+
+    @trace
+    def add_pending_note(self, note: str) -> None:
         try:
-            with self.conn:
-                self.conn.execute(
-                    "INSERT OR REPLACE INTO permanent_memory (id, notes) VALUES (1, ?)", (notes,)
+            with self._conn_lock, self.conn:
+                self.conn.execute("INSERT INTO pending_notes (note) VALUES (?)", (note,))
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to queue note: {e}")
+            raise
+
+    @trace
+    def get_pending_notes(self) -> List[Tuple[int, str]]:
+        """Returns queued (id, note) rows, oldest first."""
+        try:
+            with self._conn_lock:
+                return self.conn.execute("SELECT id, note FROM pending_notes ORDER BY id").fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to get pending notes: {e}")
+            raise
+
+    @trace
+    def delete_pending_notes(self, up_to_id: int) -> None:
+        """Removes queued notes up to and including up_to_id, leaving any queued since."""
+        try:
+            with self._conn_lock, self.conn:
+                self.conn.execute("DELETE FROM pending_notes WHERE id <= ?", (up_to_id,))
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to delete pending notes: {e}")
+            raise
+
+    @trace
+    def load_cached_responses(self, since: float, limit: int) -> List[Tuple[int, str, str, str, bytes, float]]:
+        """Prunes the response cache to the newest limit rows created at or after since, and returns them.
+
+        Rows are (id, prompt, response, cache_key, embedding, created_at), oldest first.
+        """
+        try:
+            with self._conn_lock, self.conn:
+                self.conn.execute("DELETE FROM response_cache WHERE created_at < ?", (since,))
+                self.conn.execute("""
+                    DELETE FROM response_cache WHERE id NOT IN (
+                        SELECT id FROM response_cache ORDER BY id DESC LIMIT ?
+                    )
+                """, (limit,))
+                cursor = self.conn.execute(
+                    "SELECT id, prompt, response, cache_key, embedding, created_at FROM response_cache ORDER BY id"
                 )
-                self.logger.info("Permanent memory updated.")
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to load cached responses: {e}")
+            return []
+
+    @trace
+    def add_cached_response(self, cache_id: int, prompt: str, response: str, cache_key: str,
+                            embedding: bytes, created_at: float, evicted_ids: Iterable[int] = ()) -> None:
+        """Stores a response cache entry and drops the entries it evicted, in one transaction."""
+        try:
+            with self._conn_lock, self.conn:
+                self.conn.execute(self._SQL_ADD_CACHED_RESPONSE, (cache_id, prompt, response, cache_key, embedding, created_at))
+                self.conn.executemany(self._SQL_DELETE_CACHED_RESPONSE, ((evicted_id,) for evicted_id in evicted_ids))
+        except sqlite3.Error as e:
+            self.logger.error(f"Failed to store cached response {cache_id}: {e}")
+
+    @trace
+    def delete_cached_response(self, cache_id: int) -> None:
+        try:
+            with self._conn_lock, self.conn:
+                self.conn.execute(self._SQL_DELETE_CACHED_RESPONSE, (cache_id,))
         except sqlite3.Error as e:
-            self.logger.error(f"Failed to update permanent memory: {e}")
-            raise
\ No newline at end of file
+            self.logger.error(f"Failed to delete cached response {cache_id}: {e}")
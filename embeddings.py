@@ -0,0 +1,183 @@
+"""
+Loads the sentence embedding model shared by the semantic memory and response cache.
+
+An ONNX Runtime export of all-MiniLM-L6-v2 is used when one is present, since it
+runs markedly faster on CPU than PyTorch; otherwise SentenceTransformer is used.
+Export the model once with:
+
+    optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 onnx_minilm/
+
+and optionally quantize it (use --arm64 on ARM hosts), pointing
+SULPHITE_ONNX_MODEL_DIR at the quantized directory:
+
+    optimum-cli onnxruntime quantize --avx512 --onnx_model onnx_minilm -o onnx_minilm_int8
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple, Union
+
+# Must be set before the tokenizers library is imported by sentence_transformers.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from logging_config import get_logger
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = os.getenv("SULPHITE_ONNX_MODEL_DIR", "onnx_minilm")
+# Chat snippets are short; capping the sequence length keeps attention cheap.
+MAX_SEQ_LENGTH = 128
+# Optional reduced-precision weights for the PyTorch model ("bfloat16" suits CPUs with
+# AVX-512 BF16/AMX, "float16" suits GPUs). Outputs are always cast back to float32.
+EMBEDDING_DTYPE = os.getenv("SULPHITE_EMBEDDING_DTYPE", "float32").lower()
+_TORCH_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+logger = get_logger("embeddings")
+torch.set_num_threads(os.cpu_count() or 1)
+
+
+class OnnxSentenceEmbedder:
+    """ONNX Runtime stand-in for the parts of the SentenceTransformer API the app uses."""
+
+    def __init__(self, model_dir: str, max_seq_length: int = MAX_SEQ_LENGTH):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, provider="CPUExecutionProvider")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False) -> np.ndarray:
+        """Mean-pooled sentence embeddings as a float32 (n, dim) array."""
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        if not sentences:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            token_embeddings = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            batches.append((token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+
+        embeddings = np.vstack(batches).astype(np.float32, copy=False)
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+
+_embedding_model: Union[SentenceTransformer, OnnxSentenceEmbedder, None] = None
+_embedder_lock = threading.Lock()
+
+def get_embedder() -> Union[SentenceTransformer, OnnxSentenceEmbedder]:
+    """Loads the sentence embedding model on first use and shares it process-wide."""
+    global _embedding_model
+    if _embedding_model is not None:
+        return _embedding_model
+    # The main thread and the batcher worker may both ask first; only one loads the model.
+    with _embedder_lock:
+        if _embedding_model is not None:
+            return _embedding_model
+        model = None
+        if os.path.isdir(ONNX_MODEL_DIR):
+            try:
+                model = OnnxSentenceEmbedder(ONNX_MODEL_DIR)
+                logger.info("Loaded ONNX Runtime embedding model from '%s'", ONNX_MODEL_DIR)
+            except ImportError as e:
+                logger.warning("ONNX model found but optimum is not installed (%s); using PyTorch", e)
+        if model is None:
+            model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+            model.max_seq_length = MAX_SEQ_LENGTH
+            if EMBEDDING_DTYPE not in _TORCH_DTYPES:
+                logger.warning("Unknown SULPHITE_EMBEDDING_DTYPE '%s'; using float32", EMBEDDING_DTYPE)
+            elif EMBEDDING_DTYPE != "float32":
+                model.to(_TORCH_DTYPES[EMBEDDING_DTYPE])
+                logger.info("Embedding model weights cast to %s", EMBEDDING_DTYPE)
+        _embedding_model = model
+    return _embedding_model
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent small encode requests into a single model forward pass.
+
+    A worker thread takes the first pending request. If more requests are
+    already queued, it keeps collecting for up to max_wait_ms or until
+    max_batch_size texts are pending; a lone request is encoded at once.
+    It encodes them together and hands each caller its slice of the result.
+    Embeddings are always L2-normalized float32.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.SimpleQueue[Tuple[List[str], Future]]" = queue.SimpleQueue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts).result()
+
+    async def aencode(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            pending_texts = len(pending[0][0])
+            # Waiting only pays off under concurrent load; a lone request goes straight through.
+            deadline = time.monotonic() + (0 if self._queue.empty() else self.max_wait)
+            while pending_texts < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                pending_texts += len(request[0])
+
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                embeddings = np.ascontiguousarray(get_embedder().encode(
+                    texts, batch_size=self.max_batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+                ), dtype=np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in pending:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+def get_batcher() -> EmbeddingBatcher:
+    """Returns the process-wide embedding batcher, starting its worker on first use."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EmbeddingBatcher()
+    return _batcher
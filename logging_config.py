@@ -17,11 +17,18 @@ Date: September 28, 2025
 Version: 1.0
 """
 
+import atexit
+import functools
 import logging
-import inspect
+import logging.handlers
 import os
-from datetime import datetime
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Callable, Dict, Optional
+
+def _truncate(obj: Any, limit: int = 200) -> str:
+    """Stringifies obj once, cutting it to limit characters plus an ellipsis."""
+    text = str(obj)
+    return text if len(text) <= limit else text[:limit] + "..."
 
 class SulphiteLogger:
     """
@@ -34,21 +41,28 @@ class SulphiteLogger:
     Attributes:
         log_dir (str): Directory where log files are stored
         log_file (str): Main log file path
-        loggers (Dict): Dictionary of component-specific loggers
     """
     
-    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO):
+    _FILE_HANDLER_NAME = "sulphite.file"
+    _CONSOLE_HANDLER_NAME = "sulphite.console"
+    
+    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO, capture_caller: bool = True):
         """
         Initialize the Sulphite logging system.
         
         Args:
             log_dir (str): Directory to store log files
             log_level (int): Default logging level
+            capture_caller (bool): Whether records carry the caller's file, function and
+                line. The log_* helpers pass stacklevel=2 so these point at the code that
+                called them. Disabling this skips logging's per-record stack lookup, and
+                those fields then read "(unknown file)".
         """
+        if not capture_caller:
+            logging._srcfile = None
         self.log_dir = log_dir
         self.log_level = log_level
-        self.log_file = os.path.join(log_dir, f"sulphite_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-        self.loggers = {}
+        self.log_file = os.path.abspath(os.path.join(log_dir, time.strftime('sulphite_%Y%m%d_%H%M%S.log')))
         
         # Create logs directory if it doesn't exist
         os.makedirs(log_dir, exist_ok=True)
@@ -62,7 +76,16 @@ class SulphiteLogger:
         
         Sets up both file and console logging with detailed formatting
         that includes caller information (file, function, line number).
+        Idempotent: if another SulphiteLogger already installed its handlers
+        on the root logger, they are reused and this instance logs to the
+        same file instead of adding duplicates.
         """
+        root_logger = logging.getLogger()
+        existing = {handler.get_name(): handler for handler in root_logger.handlers}
+        if self._FILE_HANDLER_NAME in existing:
+            self.log_file = existing[self._FILE_HANDLER_NAME].target.baseFilename
+            return
+        
         # Create custom formatter that includes caller information
         detailed_formatter = logging.Formatter(
             fmt='%(asctime)s | %(name)s | %(levelname)-8s | %(filename)s:%(funcName)s:%(lineno)d | %(message)s',
@@ -75,22 +98,39 @@ class SulphiteLogger:
             datefmt='%H:%M:%S'
         )
         
-        # Create file handler
-        file_handler = logging.FileHandler(self.log_file, mode='a', encoding='utf-8')
+        # Create file handler; records are buffered and written in batches, flushing
+        # immediately on ERROR and at interpreter exit
+        raw_file_handler = logging.FileHandler(self.log_file, mode='a', encoding='utf-8', delay=True)
+        raw_file_handler.setFormatter(detailed_formatter)
+        file_handler = logging.handlers.MemoryHandler(
+            capacity=256, flushLevel=logging.ERROR, target=raw_file_handler, flushOnClose=True
+        )
         file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(detailed_formatter)
+        file_handler.set_name(self._FILE_HANDLER_NAME)
+        atexit.register(file_handler.flush)
         
-        # Create console handler
-        console_handler = logging.StreamHandler()
+        # Create console handler; routine INFO chatter is batched and written out
+        # before each prompt (see flush_console), while warnings flush immediately
+        raw_console_handler = logging.StreamHandler()
+        raw_console_handler.setFormatter(console_formatter)
+        console_handler = logging.handlers.MemoryHandler(
+            capacity=32, flushLevel=logging.WARNING, target=raw_console_handler, flushOnClose=True
+        )
         console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(console_formatter)
+        console_handler.set_name(self._CONSOLE_HANDLER_NAME)
+        atexit.register(console_handler.flush)
         
         # Configure root logger
-        root_logger = logging.getLogger()
         root_logger.setLevel(logging.DEBUG)
         root_logger.addHandler(file_handler)
         root_logger.addHandler(console_handler)
     
+    def flush_console(self) -> None:
+        """Writes out any console log records still held in the buffer."""
+        for handler in logging.getLogger().handlers:
+            if handler.get_name() == self._CONSOLE_HANDLER_NAME:
+                handler.flush()
+    
     def get_logger(self, name: str) -> logging.Logger:
         """
         Get or create a logger for a specific component.
@@ -101,28 +141,32 @@ class SulphiteLogger:
         Returns:
             logging.Logger: Configured logger for the component
         """
-        if name not in self.loggers:
-            logger = logging.getLogger(f"sulphite.{name}")
-            logger.setLevel(self.log_level)
-            self.loggers[name] = logger
-        
-        return self.loggers[name]
+        logger = logging.getLogger(f"sulphite.{name}")
+        logger.setLevel(self.log_level)
+        return logger
     
-    def log_function_entry(self, logger: logging.Logger, function_name: str, **kwargs) -> None:
+    def log_function_entry(self, logger: logging.Logger, function_name: str,
+                           params: Optional[Dict[str, Any]] = None, **kwargs) -> None:
         """
         Log function entry with parameters.
         
+        Hot call sites should pass a prebuilt params mapping (or nothing) rather
+        than keyword arguments, so no kwargs dict is built when DEBUG is off.
+        
         Args:
             logger (logging.Logger): Logger instance to use
             function_name (str): Name of the function being entered
-            **kwargs: Function parameters to log
+            params (Optional[Dict[str, Any]]): Function parameters to log
+            **kwargs: Additional function parameters to log
         """
-        caller_frame = inspect.currentframe().f_back
-        filename = os.path.basename(caller_frame.f_code.co_filename)
-        line_number = caller_frame.f_lineno
-        
-        params = ", ".join([f"{k}={v}" for k, v in kwargs.items() if not k.startswith('_')])
-        logger.debug(f"ENTRY: {filename}:{function_name}:{line_number} | Parameters: {params}")
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        if params and kwargs:
+            params = {**params, **kwargs}
+        else:
+            params = params or kwargs
+        params_str = ", ".join([f"{k}={v}" for k, v in params.items() if not k.startswith('_')])
+        logger.debug("ENTRY: %s | Parameters: %s", function_name, params_str, stacklevel=2)
     
     def log_function_exit(self, logger: logging.Logger, function_name: str, result: Any = None) -> None:
         """
@@ -133,12 +177,9 @@ class SulphiteLogger:
             function_name (str): Name of the function being exited
             result (Any): Return value of the function
         """
-        caller_frame = inspect.currentframe().f_back
-        filename = os.path.basename(caller_frame.f_code.co_filename)
-        line_number = caller_frame.f_lineno
-        
-        result_str = str(result)[:200] + "..." if len(str(result)) > 200 else str(result)
-        logger.debug(f"EXIT: {filename}:{function_name}:{line_number} | Result: {result_str}")
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("EXIT: %s | Result: %s", function_name, _truncate(result), stacklevel=2)
     
     def log_query_processing(self, logger: logging.Logger, query: str, stage: str, details: Dict[str, Any] = None) -> None:
         """
@@ -150,14 +191,13 @@ class SulphiteLogger:
             stage (str): Current processing stage
             details (Dict): Additional details about the processing stage
         """
-        caller_frame = inspect.currentframe().f_back
-        filename = os.path.basename(caller_frame.f_code.co_filename)
-        line_number = caller_frame.f_lineno
-        
-        query_preview = query[:100] + "..." if len(query) > 100 else query
-        details_str = f" | Details: {details}" if details else ""
-        
-        logger.info(f"QUERY_PROCESSING: {filename}:{line_number} | Stage: {stage} | Query: '{query_preview}'{details_str}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        query_preview = _truncate(query, 100)
+        if details:
+            logger.info("QUERY_PROCESSING: Stage: %s | Query: '%s' | Details: %s", stage, query_preview, details, stacklevel=2)
+        else:
+            logger.info("QUERY_PROCESSING: Stage: %s | Query: '%s'", stage, query_preview, stacklevel=2)
     
     def log_classification_result(self, logger: logging.Logger, query: str, result: Dict[str, Any]) -> None:
         """
@@ -168,13 +208,10 @@ class SulphiteLogger:
             query (str): The classified query
             result (Dict): Classification result dictionary
         """
-        caller_frame = inspect.currentframe().f_back
-        filename = os.path.basename(caller_frame.f_code.co_filename)
-        line_number = caller_frame.f_lineno
-        
-        query_preview = query[:50] + "..." if len(query) > 50 else query
-        
-        logger.info(f"CLASSIFICATION: {filename}:{line_number} | Query: '{query_preview}' | Result: {result}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        query_preview = _truncate(query, 50)
+        logger.info("CLASSIFICATION: Query: '%s' | Result: %s", query_preview, result, stacklevel=2)
     
     def log_database_operation(self, logger: logging.Logger, operation: str, details: Dict[str, Any] = None) -> None:
         """
@@ -185,24 +222,85 @@ class SulphiteLogger:
             operation (str): Type of database operation
             details (Dict): Operation details
         """
-        caller_frame = inspect.currentframe().f_back
-        filename = os.path.basename(caller_frame.f_code.co_filename)
-        line_number = caller_frame.f_lineno
-        
-        details_str = f" | Details: {details}" if details else ""
-        logger.info(f"DB_OPERATION: {filename}:{line_number} | Operation: {operation}{details_str}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        if details:
+            logger.info("DB_OPERATION: Operation: %s | Details: %s", operation, details, stacklevel=2)
+        else:
+            logger.info("DB_OPERATION: Operation: %s", operation, stacklevel=2)
+
+@functools.lru_cache(maxsize=None)
+def _get_sulphite_logger() -> SulphiteLogger:
+    """Creates the global SulphiteLogger, and with it the log file, on first use."""
+    return SulphiteLogger(capture_caller=os.getenv("SULPHITE_LOG_CALLER", "1") != "0")
 
-# Global logger instance
-sulphite_logger = SulphiteLogger()
+def __getattr__(name: str):
+    # PEP 562: `sulphite_logger` is built lazily so importing this module installs no handlers.
+    if name == "sulphite_logger":
+        return _get_sulphite_logger()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Component loggers handed out by get_logger, keyed by component name
+_COMPONENT_LOGGERS: Dict[str, logging.Logger] = {}
 
 def get_logger(component_name: str) -> logging.Logger:
     """
     Convenience function to get a logger for a specific component.
     
+    Loggers are kept in _COMPONENT_LOGGERS, so repeated lookups for a
+    component are a single dict hit. The first lookup goes through
+    SulphiteLogger, which installs the handlers and sets the level.
+    
     Args:
         component_name (str): Name of the component
     
     Returns:
         logging.Logger: Configured logger instance
     """
-    return sulphite_logger.get_logger(component_name)
\ No newline at end of file
+    logger = _COMPONENT_LOGGERS.get(component_name)
+    if logger is None:
+        logger = _COMPONENT_LOGGERS[component_name] = _get_sulphite_logger().get_logger(component_name)
+    return logger
+
+def flush_console() -> None:
+    """Convenience function to flush buffered console records, e.g. before prompting for input."""
+    _get_sulphite_logger().flush_console()
+
+# Read once at import; when off, trace() hands functions back undecorated.
+_TRACE_ENABLED = os.environ.get("SULPHITE_TRACE") == "1"
+
+def trace(fn: Callable) -> Callable:
+    """
+    Decorator that logs entry and exit of the wrapped function at DEBUG level.
+    
+    Tracing is controlled by the SULPHITE_TRACE environment variable, read once
+    at import. When it is not "1", the function is returned unchanged, so
+    decorated code pays no per-call cost. When it is, the component logger is
+    lowered to DEBUG so the records are actually emitted. A leading self or
+    cls argument is left out of the logged arguments.
+    
+    Args:
+        fn (Callable): Function or method to trace
+    
+    Returns:
+        Callable: The traced wrapper, or fn itself when tracing is disabled
+    """
+    if not _TRACE_ENABLED:
+        return fn
+    logger = get_logger(fn.__module__)
+    logger.setLevel(logging.DEBUG)
+    name = fn.__qualname__
+    # Methods are traced with their explicit arguments only; self's repr is just noise.
+    skip_first = fn.__code__.co_varnames[:1] in (("self",), ("cls",))
+    
+    sulphite_logger = _get_sulphite_logger()
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return fn(*args, **kwargs)
+        sulphite_logger.log_function_entry(logger, name, {"args": args[1:] if skip_first else args, **kwargs})
+        result = fn(*args, **kwargs)
+        sulphite_logger.log_function_exit(logger, name, result)
+        return result
+    return wrapper
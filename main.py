@@ -1,70 +1,113 @@
 # professorsulphite/sulphite_v1/sulphite_v1-e0f21b0d541b71aa42e22e2435a9b0b9f2caa2e4/main.py
 import sys
-from dotenv import load_dotenv
 from database import Database
-from chat_manager import ChatManager
-from logging_config import get_logger
-from state_manager import StateManager
+from logging_config import flush_console, get_logger, trace
 
-load_dotenv()
+USAGE = """Usage: python main.py [--build-memory-index]
 
-class SulphiteApp:
-    def __init__(self):
-        self.logger = get_logger("main")
-        try:
-            self.db = Database()
-            self.state = StateManager(self.db)
-            self.chat_manager = ChatManager(self.db, self.state)
-            self.running = True
-            self.logger.info(f"Sulphite application initialized successfully on session {self.state.get_session_id()}")
-        except Exception as e:
-            self.logger.error(f"Failed to initialize Sulphite application: {e}")
-            raise
+  --build-memory-index  Embed every stored message into the global memory index and exit
+  --help                Show this message and exit"""
 
-    def print_help(self) -> None:
-        help_text = """
+# Values accepted by /lang.
+_LANG_MODES = frozenset({"english", "urdu", "auto"})
+
+# Command history for the interactive prompt, used when prompt_toolkit is installed.
+HISTORY_FILE = ".sulphite_history"
+
+class SulphiteApp:
+    _HELP_BANNER = """
 ╔══════════════════════════════════════════════════════════════╗
 ║                    SULPHITE LEARNING ASSISTANT               ║
 ╠══════════════════════════════════════════════════════════════╣
 ║  /lang <mode>     - Set language ('english', 'urdu', 'auto') ║
 ║  /addnote <text>  - Add a permanent note about the user      ║
+║  /addnote --batch <text> - Queue a note for /flushnotes      ║
+║  /flushnotes      - Summarize queued notes in one request    ║
 ║  /new [name]      - Start a new session (optional name)      ║
 ║  /clear           - Clear current session's memory           ║
 ║  /quit            - Quit the application                     ║
 ║  /help            - Show this help message                   ║
 ╚══════════════════════════════════════════════════════════════╝
-        """
-        print(help_text)
 
+"""
+    _WELCOME_BANNER = (
+        "╔══════════════════════════════════════════════════════════════╗\n"
+        "║              🎓 SULPHITE LEARNING ASSISTANT 🎓               ║\n"
+        "║        Your Adaptive AI Tutor for Middle School Math         ║\n"
+        "║              Type /help for available commands               ║\n"
+        "╚══════════════════════════════════════════════════════════════╝\n"
+    )
+
+    def __init__(self, db: Database):
+        self.logger = get_logger("main")
+        try:
+            # Deferred so that --help and bad arguments never load the model SDKs.
+            from chat_manager import ChatManager
+            from state_manager import StateManager
+            self.db = db
+            self.state = StateManager(self.db)
+            self.chat_manager = ChatManager(self.db, self.state)
+            self.running = True
+            self._read_line = input
+            # prompt_toolkit needs a terminal; piped or redirected input keeps using input().
+            if sys.stdin.isatty():
+                try:
+                    from prompt_toolkit import PromptSession
+                    from prompt_toolkit.history import FileHistory
+                    self._read_line = PromptSession(history=FileHistory(HISTORY_FILE)).prompt
+                except ImportError:  # prompt_toolkit is optional; plain input() has no history
+                    pass
+            # command -> (handler, takes the argument string)
+            self._dispatch = {
+                '/quit': (self._handle_quit_command, False),
+                '/help': (self.print_help, False),
+                '/lang': (self._handle_lang_command, True),
+                '/addnote': (self._handle_addnote_command, True),
+                '/flushnotes': (self._handle_flushnotes_command, False),
+                '/new': (self._handle_new_session_command, True),
+                '/clear': (self._handle_clear_command, False),
+            }
+            self.logger.info("Sulphite application initialized successfully on session %s", self.state.get_session_id())
+        except Exception as e:
+            self.logger.error("Failed to initialize Sulphite application: %s", e)
+            raise
+
+    def print_help(self) -> None:
+        sys.stdout.write(self._HELP_BANNER)
+
+    @trace
     def process_command(self, user_input: str) -> bool:
         try:
             if user_input.startswith('/'):
-                parts = user_input.split()
-                command = parts[0].lower()
-                args = parts[1:]
-                arg_str = " ".join(args)
-                
-                if command == '/quit': return False
-                elif command == '/help': self.print_help()
-                elif command == '/lang': self._handle_lang_command(args)
-                elif command == '/addnote': self._handle_addnote_command(arg_str)
-                elif command == '/new': self._handle_new_session_command(arg_str)
-                elif command == '/clear': self._handle_clear_command()
-                else: print(f"❌ Unknown command: {command}. Type /help for commands.")
+                command, _, arg_str = user_input.partition(' ')
+                command = command.lower()
+                handler, needs_args = self._dispatch.get(command, (None, False))
+                if handler is None:
+                    print(f"❌ Unknown command: {command}. Type /help for commands.")
+                    return True
+                # Only /quit returns False; the other handlers return None. Handlers are
+                # not traced individually; this one record covers the dispatch.
+                keep_running = (handler(arg_str.lstrip()) if needs_args else handler()) is not False
+                self.logger.info("command=%s outcome=%s", command, "continue" if keep_running else "quit")
+                return keep_running
             else:
                 self._process_ai_interaction(user_input)
             return True
         except Exception as e:
-            self.logger.error(f"Error processing command '{user_input}': {e}")
+            self.logger.error("Error processing command '%s': %s", user_input, e)
             print(f"An error occurred: {e}")
             return True
 
-    def _handle_lang_command(self, args: list):
-        if not args or args[0].lower() not in ["english", "urdu", "auto"]:
+    def _handle_quit_command(self) -> bool:
+        return False
+
+    def _handle_lang_command(self, arg_str: str):
+        args = arg_str.split()
+        mode = args[0].lower() if args else ""
+        if mode not in _LANG_MODES:
             print("⚠️ Usage: /lang <english|urdu|auto>")
             return
         
-        mode = args[0].lower()
         self.state.set_language_mode(mode)
         new_session_name = f"session_{mode}_{self.state.get_session_id() + 1}"
         self.state.new_session(new_session_name)
@@ -72,15 +115,33 @@ class SulphiteApp:
         print(f"✓ Language mode set to: {mode}. Started a new session.")
 
     def _handle_addnote_command(self, note_text: str):
+        parts = note_text.split(None, 1)
+        batch = bool(parts) and parts[0] == "--batch"
+        if batch:
+            note_text = parts[1].strip() if len(parts) > 1 else ""
         if not note_text:
-            print("⚠️ Usage: /addnote <your note here>")
+            print("⚠️ Usage: /addnote [--batch] <your note here>")
             return
         if len(note_text) > 300:
             print("⚠️ Note too long (max 300 words).")
             return
+        if batch:
+            # Queued notes are summarized together by /flushnotes instead of one model call each.
+            self.db.add_pending_note(note_text)
+            print("✓ Note queued. Use /flushnotes to add queued notes to permanent memory.")
+            return
         self.chat_manager.summarize_and_save_note(note_text)
         print("✓ Permanent memory updated.")
 
+    def _handle_flushnotes_command(self):
+        pending = self.db.get_pending_notes()
+        if not pending:
+            print("No queued notes.")
+            return
+        self.chat_manager.summarize_and_save_note("\n\n".join(note for _, note in pending))
+        self.db.delete_pending_notes(pending[-1][0])
+        print(f"✓ Permanent memory updated from {len(pending)} queued notes.")
+
     def _handle_new_session_command(self, session_name: str):
         name = session_name if session_name else f"session_{self.state.get_session_id() + 1}"
         self.state.new_session(name)
@@ -92,31 +153,47 @@ class SulphiteApp:
         self.chat_manager.initialize_session_memory()
         print("✓ Current session memory cleared.")
 
+    @trace
     def _process_ai_interaction(self, message: str):
-        self.state.set_current_prompt(message)
-        response = self.chat_manager.call_model()
-        print(f"\n🤖 Assistant: {response}\n")
+        sys.stdout.write("\n🤖 Assistant: ")
+        response_length = 0
+        for chunk in self.chat_manager.call_model_stream(message):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            response_length += len(chunk)
+        sys.stdout.write("\n\n")
+        self.logger.debug("AI interaction complete: response_length=%d", response_length)
 
+    @trace
     def run(self):
-        print("╔══════════════════════════════════════════════════════════════╗")
-        print("║              🎓 SULPHITE LEARNING ASSISTANT 🎓               ║")
-        print("║        Your Adaptive AI Tutor for Middle School Math         ║")
-        print("║              Type /help for available commands               ║")
-        print("╚══════════════════════════════════════════════════════════════╝")
+        sys.stdout.write(self._WELCOME_BANNER)
         
         while self.running:
             try:
-                user_input = input("💭 > ").strip()
+                flush_console()
+                user_input = self._read_line("💭 > ").strip()
                 if not user_input: continue
                 self.running = self.process_command(user_input)
             except (KeyboardInterrupt, EOFError):
                 self.running = False
+        self.chat_manager.save_session_memory()
         print("\n👋 Goodbye!")
 
 def main():
+    if "--help" in sys.argv[1:] or "-h" in sys.argv[1:]:
+        print(USAGE)
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    if "--build-memory-index" in sys.argv[1:]:
+        from chat_manager import build_global_memory_index
+        with Database() as db:
+            print(f"✓ Indexed {build_global_memory_index(db)} memory entries.")
+        return
     try:
-        app = SulphiteApp()
-        app.run()
+        with Database() as db:
+            app = SulphiteApp(db)
+            app.run()
     except Exception as e:
         print(f"❌ A fatal error occurred: {e}")
         sys.exit(1)
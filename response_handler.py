@@ -2,24 +2,24 @@
 """
 Handles all logic related to generating AI responses, including prompt construction and model invocation.
 """
-from typing import Tuple
+from typing import Iterator, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 import config
 
+# Fixed text between the per-turn context and the user's query; the query always comes last.
+_LATEST_MESSAGE_INSTRUCTION = "\n\nIMPORTANT: Now, focusing only on the user's LATEST message, respond to: "
+
 class ResponseHandler:
     def __init__(self, model: ChatGoogleGenerativeAI):
         self.model = model
+        self._format_summarize_note_prompt = config.SUMMARIZE_NOTE_PROMPT.format
 
     def _build_final_prompt(self, system_prompt: str, context: str, user_query: str) -> Tuple[SystemMessage, HumanMessage]:
         """Constructs the final prompt with context and instructions."""
         final_system_prompt = SystemMessage(content=system_prompt)
         
-        contextualized_query = (
-            f"{context}\n\n"
-            f"IMPORTANT: Now, focusing only on the user's LATEST message, respond to: {user_query}"
-        )
-        final_user_prompt = HumanMessage(content=contextualized_query)
+        final_user_prompt = HumanMessage(content="".join((context, _LATEST_MESSAGE_INSTRUCTION, user_query)))
         
         return final_system_prompt, final_user_prompt
 
@@ -29,12 +29,19 @@ class ResponseHandler:
         response = self.model.invoke([system_msg, user_msg])
         return response.content
 
+    def stream_response(self, system_prompt: str, context: str, user_query: str) -> Iterator[str]:
+        """Streams a standard response as text chunks while the model generates it."""
+        system_msg, user_msg = self._build_final_prompt(system_prompt, context, user_query)
+        for chunk in self.model.stream([system_msg, user_msg]):
+            if chunk.content:
+                yield chunk.content
+
     def answer_identity_question(self) -> str:
         """Provides a safe and consistent answer to 'who are you?'."""
-        return config.get_prompt("identity_prompt")
+        return config.IDENTITY_PROMPT
 
     def summarize_note(self, note_text: str) -> str:
         """Summarizes text to be stored in permanent memory."""
-        prompt = config.get_prompt("summarize_note_prompt").format(note_text=note_text)
+        prompt = self._format_summarize_note_prompt(note_text=note_text)
         response = self.model.invoke([HumanMessage(content=prompt)])
         return response.content.strip()
\ No newline at end of file
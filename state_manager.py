@@ -10,7 +10,6 @@ class StateManager:
         self.session_id: int = 1
         self.language_mode: str = "auto"
         self.permanent_memory: str = ""
-        self.current_prompt: str = ""
         self.load_permanent_memory()
 
     def set_language_mode(self, mode: str):
@@ -46,9 +45,3 @@ class StateManager:
     def update_permanent_memory(self, new_notes: str):
         self.permanent_memory = new_notes
         self.db.update_permanent_memory(new_notes)
-        
-    def set_current_prompt(self, prompt: str):
-        self.current_prompt = prompt
-
-    def get_current_prompt(self) -> str:
-        return self.current_prompt
\ No newline at end of file